@@ -0,0 +1,9 @@
+"""
+Benchmarks of the recommenders, the search and the API routes against a synthetic catalog,
+with local stand-ins for TMDB and OpenAI. Run from the app directory:
+
+    python -m benchmarks.run run --movies 27000 --concurrency 8
+    python -m benchmarks.run compare benchmarks/results/<old>.json benchmarks/results/<new>.json
+
+The run writes into a separate database (BENCHMARK_DATABASE_URL), never into the app's one.
+"""
@@ -0,0 +1,266 @@
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+import numpy as np
+
+from benchmarks.synthetic_data import GENRES, SyntheticCatalog
+
+OPENAI_EMBEDDING_DIMENSIONS = 1536
+_MOVIE_PATH = re.compile(r"^/3/movie/(\d+)$")
+_POSTER_PATH = re.compile(r"^/t/p/\w+/synthetic(\d+)\.jpg$")
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive, like the real APIs
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _delay(self):
+        latency = self.server.latency
+        if latency:
+            time.sleep(random.uniform(0.5 * latency, 1.5 * latency))
+
+    def _throttled(self):
+        """
+        Answers 429 with Retry-After for a share of the requests, to exercise the clients' retries.
+        """
+        if self.server.error_rate and random.random() < self.server.error_rate:
+            self._send(429, {"error": {"message": "Rate limit reached", "type": "requests"}}, {"Retry-After": "0"})
+            return True
+        return False
+
+    def _send(self, status, payload, headers=None, content_type="application/json"):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeTMDBHandler(_Handler):
+    """
+    `/3/movie/{id}` answers the synthetic catalog's movie, `/t/p/<size>/synthetic{id}.jpg` a generated poster.
+    """
+
+    def do_GET(self):
+        self._delay()
+        if self._throttled():
+            return
+        path = self.path.split("?", 1)[0]
+        match = _MOVIE_PATH.match(path)
+        if match:
+            payload = self.server.catalog.tmdb_payload(int(match.group(1)))
+            if payload is None:
+                return self._send(404, {"status_code": 34, "status_message": "The resource you requested could not be found."})
+            return self._send(200, payload)
+        match = _POSTER_PATH.match(path)
+        if match:
+            return self._send(200, _poster(self.server.catalog, int(match.group(1))), content_type="image/jpeg")
+        self._send(404, {"status_code": 34, "status_message": "Unknown path"})
+
+
+@lru_cache(maxsize=1024)
+def _poster(catalog, movie_id):
+    """
+    A small JPEG coloured by the movie's first genre, so CLIP sees genre-correlated images.
+    """
+    from PIL import Image, ImageDraw
+
+    movie = catalog.movie(movie_id)
+    hue = GENRES.index(movie.genres[0]) / len(GENRES)
+    rng = np.random.default_rng([catalog.seed, movie_id])
+    image = Image.new("HSV", (200, 300), (int(hue * 255), 180, 200)).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for _ in range(8):
+        x, y = rng.integers(0, 200), rng.integers(0, 300)
+        draw.ellipse((x, y, x + 40, y + 40), fill=tuple(int(c) for c in rng.integers(0, 256, size=3)))
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=80)
+    return buffer.getvalue()
+
+
+class FakeOpenAIHandler(_Handler):
+    """
+    POST /v1/embeddings: deterministic bag-of-words embeddings, so texts sharing words are close.
+    POST /v1/responses: a structured recommendation list of catalog titles, derived from the prompt.
+    """
+
+    def do_POST(self):
+        self._delay()
+        if self._throttled():
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        path = self.path.split("?", 1)[0]
+        if path.endswith("/embeddings"):
+            return self._send(200, self._embeddings(request))
+        if path.endswith("/responses"):
+            return self._send(200, self._response(request))
+        self._send(404, {"error": {"message": f"Unknown path {path}", "type": "invalid_request_error"}})
+
+    def _embeddings(self, request):
+        texts = request["input"]
+        texts = [texts] if isinstance(texts, str) else texts
+        dimensions = request.get("dimensions") or OPENAI_EMBEDDING_DIMENSIONS
+        data = []
+        for index, text in enumerate(texts):
+            embedding = text_embedding(text)[:dimensions]
+            embedding = embedding / (np.linalg.norm(embedding) or 1.0)
+            if request.get("encoding_format") == "base64":
+                # The SDK asks for base64 float32 by default
+                value = base64.b64encode(embedding.astype("<f4").tobytes()).decode()
+            else:
+                value = embedding.tolist()
+            data.append({"object": "embedding", "index": index, "embedding": value})
+        tokens = sum(len(text) // 4 + 1 for text in texts)
+        return {
+            "object": "list",
+            "data": data,
+            "model": request.get("model"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    def _response(self, request):
+        prompt = json.dumps(request.get("input"))
+        rng = random.Random(zlib.crc32(prompt.encode()))
+        catalog = self.server.catalog
+        titles = [catalog.movie(rng.randint(1, catalog.size)).title for _ in range(10)]
+        # Like a real LLM, drop the year of some titles and invent one
+        titles = [title.rsplit(" (", 1)[0] if rng.random() < 0.5 else title for title in titles]
+        titles.append("A Movie That Does Not Exist")
+        text = json.dumps({"recommended_titles": titles})
+        return {
+            "id": f"resp_{hashlib.md5(prompt.encode()).hexdigest()}",
+            "object": "response",
+            "created_at": int(time.time()),
+            "status": "completed",
+            "model": request.get("model"),
+            "output": [{
+                "id": "msg_0",
+                "type": "message",
+                "role": "assistant",
+                "status": "completed",
+                "content": [{"type": "output_text", "text": text, "annotations": []}],
+            }],
+            "parallel_tool_calls": False,
+            "tool_choice": "auto",
+            "tools": [],
+            "usage": {"input_tokens": len(prompt) // 4, "output_tokens": len(text) // 4,
+                      "total_tokens": (len(prompt) + len(text)) // 4,
+                      "input_tokens_details": {"cached_tokens": 0},
+                      "output_tokens_details": {"reasoning_tokens": 0}},
+        }
+
+
+@lru_cache(maxsize=8192)
+def _token_vector(token):
+    rng = np.random.default_rng(zlib.crc32(token.encode()))
+    return rng.normal(size=OPENAI_EMBEDDING_DIMENSIONS).astype(np.float32)
+
+
+def text_embedding(text: str) -> np.ndarray:
+    """
+    Normalised sum of one fixed random vector per word.
+    """
+    embedding = np.zeros(OPENAI_EMBEDDING_DIMENSIONS, dtype=np.float32)
+    for token in _TOKEN.findall(text.lower()):
+        embedding += _token_vector(token)
+    return embedding / (np.linalg.norm(embedding) or 1.0)
+
+
+class FakeServices:
+    """
+    Fake TMDB and OpenAI servers on background threads. Port 0 picks a free port.
+    """
+
+    def __init__(self, catalog: SyntheticCatalog, host="127.0.0.1", tmdb_port=0, openai_port=0,
+                 latency=0.0, error_rate=0.0):
+        self.tmdb = self._server(FakeTMDBHandler, host, tmdb_port, catalog, latency, error_rate)
+        self.openai = self._server(FakeOpenAIHandler, host, openai_port, catalog, latency, error_rate)
+        self._threads = []
+
+    @staticmethod
+    def _server(handler, host, port, catalog, latency, error_rate):
+        server = ThreadingHTTPServer((host, port), handler)
+        server.daemon_threads = True
+        server.catalog = catalog
+        server.latency = latency
+        server.error_rate = error_rate
+        return server
+
+    @staticmethod
+    def _url(server):
+        host, port = server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def env(self) -> dict:
+        """
+        Environment variables pointing tmdb.py and the OpenAI SDK at the fakes.
+        They are read at import time, set them before importing the app modules.
+        """
+        return {
+            "TMDB_BASE_URL": self._url(self.tmdb),
+            "TMDB_IMAGE_BASE": f"{self._url(self.tmdb)}/t/p/w500",
+            "OPENAI_BASE_URL": f"{self._url(self.openai)}/v1",
+            "OPENAI_API_KEY": "sk-benchmark",
+        }
+
+    def start(self):
+        for server in (self.tmdb, self.openai):
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        for server in (self.tmdb, self.openai):
+            server.shutdown()
+            server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve fake TMDB and OpenAI APIs over a synthetic catalog")
+    parser.add_argument("--movies", type=int, default=27000, help="size of the synthetic catalog")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--tmdb-port", type=int, default=8081)
+    parser.add_argument("--openai-port", type=int, default=8082)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="mean latency added to every answer")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of the requests answered with 429")
+    args = parser.parse_args()
+
+    services = FakeServices(SyntheticCatalog(args.movies, args.seed), args.host, args.tmdb_port, args.openai_port,
+                            args.latency_ms / 1000, args.error_rate)
+    services.start()
+    print("Fake services are up, start the app with:")
+    for name, value in services.env().items():
+        print(f"  {name}={value}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        services.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+import argparse
+import io
+import os
+import zlib
+from functools import lru_cache
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from vector_indexes import FULL_DIMENSIONS
+
+# MovieLens genres, minus "(no genres listed)"
+GENRES = [
+    "Action", "Adventure", "Animation", "Children", "Comedy", "Crime", "Documentary", "Drama", "Fantasy",
+    "Film-Noir", "Horror", "IMAX", "Musical", "Mystery", "Romance", "Sci-Fi", "Thriller", "War", "Western",
+]
+
+WORDS = [
+    "american", "angel", "army", "babe", "bad", "beach", "beast", "big", "black", "blade", "blood", "blue",
+    "boy", "bride", "broken", "brother", "city", "cold", "crazy", "dark", "day", "dead", "death", "desert",
+    "devil", "dog", "dragon", "dream", "dust", "earth", "edge", "empire", "escape", "eye", "fall", "family",
+    "father", "fire", "first", "flight", "forest", "friend", "game", "ghost", "girl", "gold", "great", "green",
+    "gun", "heart", "heat", "hero", "hill", "home", "honey", "horse", "hour", "house", "hunter", "ice", "island",
+    "jack", "journey", "judge", "jungle", "killer", "king", "kiss", "lady", "land", "last", "legend", "life",
+    "light", "little", "lost", "love", "machine", "man", "midnight", "mind", "mirror", "money", "moon", "mother",
+    "mountain", "murder", "music", "night", "ocean", "paradise", "party", "perfect", "planet", "power", "prince",
+    "queen", "rain", "red", "return", "river", "road", "rock", "room", "run", "saint", "school", "sea", "secret",
+    "shadow", "silent", "silver", "sky", "small", "snow", "soldier", "song", "space", "spirit", "star", "stone",
+    "storm", "story", "street", "summer", "sun", "sweet", "tale", "thief", "time", "town", "train", "treasure",
+    "true", "twin", "valley", "war", "water", "wedding", "west", "white", "wild", "wind", "winter", "witch",
+    "wolf", "woman", "world", "year", "young", "zero",
+]
+TAGS = ["atmospheric", "classic", "funny", "twist ending", "dark comedy", "visually appealing", "based on a book",
+        "thought-provoking", "violent", "quirky", "soundtrack", "cult film"]
+ARTICLES = ["The", "A", "An"]
+
+# Synthetic movies are linked to TMDB ids shifted by this offset, the fake TMDB maps them back
+TMDB_ID_OFFSET = 100000
+# Share of the movies without a TMDB link, like in MovieLens
+UNLINKED_SHARE = 0.01
+
+
+class SyntheticMovie(NamedTuple):
+    movie_id: int
+    title: str
+    year: int
+    genres: list
+    overview: str
+    poster_path: str
+    vote_average: float
+    cast: list
+
+
+class SyntheticCatalog:
+    """
+    Deterministic MovieLens-shaped catalog: every movie is derived from (seed, movie_id) alone,
+    so the dataset generator and the fake TMDB server agree without sharing any state.
+    """
+
+    def __init__(self, movies: int = 27000, seed: int = 0):
+        self.size = movies
+        self.seed = seed
+
+    def movie_ids(self):
+        return range(1, self.size + 1)
+
+    @lru_cache(maxsize=65536)
+    def movie(self, movie_id: int) -> SyntheticMovie:
+        rng = np.random.default_rng([self.seed, movie_id])
+        words = [WORDS[i] for i in rng.choice(len(WORDS), size=int(rng.integers(1, 5)), replace=False)]
+        title = " ".join(word.capitalize() for word in words)
+        if rng.random() < 0.25:
+            # MovieLens moves the leading article to the end
+            title = f"{title}, {ARTICLES[int(rng.integers(len(ARTICLES)))]}"
+        if rng.random() < 0.05:
+            title = f"{title} (a.k.a. {WORDS[int(rng.integers(len(WORDS)))].capitalize()} {words[0].capitalize()})"
+        year = int(rng.integers(1920, 2016))
+        genres = sorted({GENRES[i] for i in rng.choice(len(GENRES), size=int(rng.integers(1, 4)), replace=False)})
+        overview = (
+            f"A {' and '.join(genre.lower() for genre in genres)} story about "
+            f"{' '.join(WORDS[i] for i in rng.choice(len(WORDS), size=12))}."
+        )
+        cast = [f"Actor {int(i)}" for i in rng.integers(1, 5000, size=5)]
+        return SyntheticMovie(
+            movie_id=movie_id,
+            title=f"{title} ({year})",
+            year=year,
+            genres=genres,
+            overview=overview,
+            poster_path=f"/synthetic{movie_id}.jpg",
+            vote_average=round(float(rng.uniform(2, 9)), 1),
+            cast=cast,
+        )
+
+    def tmdb_id(self, movie_id: int):
+        # Hashing keeps the unlinked movies stable across runs
+        if zlib.crc32(f"{self.seed}:{movie_id}".encode()) % 10000 < UNLINKED_SHARE * 10000:
+            return None
+        return movie_id + TMDB_ID_OFFSET
+
+    def by_tmdb_id(self, tmdb_id: int):
+        movie_id = tmdb_id - TMDB_ID_OFFSET
+        if not 1 <= movie_id <= self.size:
+            return None
+        return self.movie(movie_id)
+
+    def tmdb_payload(self, tmdb_id: int):
+        """
+        The `/movie/{id}?append_to_response=credits` answer of TMDB for a synthetic movie, or None.
+        """
+        movie = self.by_tmdb_id(tmdb_id)
+        if movie is None:
+            return None
+        return {
+            "id": tmdb_id,
+            "original_title": movie.title.rsplit(" (", 1)[0],
+            "title": movie.title.rsplit(" (", 1)[0],
+            "overview": movie.overview,
+            "genres": [{"id": GENRES.index(genre), "name": genre} for genre in movie.genres],
+            "poster_path": movie.poster_path,
+            "vote_average": movie.vote_average,
+            "release_date": f"{movie.year}-01-01",
+            "credits": {"cast": [{"name": name, "order": order} for order, name in enumerate(movie.cast)]},
+        }
+
+
+def write_dataset(directory, movies=27000, users=20000, ratings_per_user=100, seed=0):
+    """
+    Writes movies.csv, links.csv, ratings.csv and tags.csv in the MovieLens format into `directory`,
+    ready for `MOVIELENS_DATA_PATH=<directory> python preprocess.py`.
+    Movie popularity follows a Zipf-like law, so a few movies collect most of the ratings like in MovieLens.
+    """
+    os.makedirs(directory, exist_ok=True)
+    catalog = SyntheticCatalog(movies, seed)
+    rng = np.random.default_rng(seed)
+
+    catalog_movies = [catalog.movie(movie_id) for movie_id in catalog.movie_ids()]
+    pd.DataFrame({
+        "movieId": [movie.movie_id for movie in catalog_movies],
+        "title": [movie.title for movie in catalog_movies],
+        "genres": ["|".join(movie.genres) for movie in catalog_movies],
+    }).to_csv(os.path.join(directory, "movies.csv"), index=False)
+
+    tmdb_ids = [catalog.tmdb_id(movie.movie_id) for movie in catalog_movies]
+    pd.DataFrame({
+        "movieId": [movie.movie_id for movie in catalog_movies],
+        "imdbId": [f"{movie.movie_id:07d}" for movie in catalog_movies],
+        "tmdbId": pd.array(tmdb_ids, dtype="Int64"),
+    }).to_csv(os.path.join(directory, "links.csv"), index=False)
+
+    # Ratings: popular movies are drawn more often, duplicates of a (user, movie) pair are dropped
+    popularity = 1.0 / np.arange(1, movies + 1) ** 1.1
+    popularity = rng.permutation(popularity)
+    popularity /= popularity.sum()
+    counts = np.clip(rng.poisson(ratings_per_user, size=users), 1, movies)
+    user_ids = np.repeat(np.arange(1, users + 1, dtype=np.int64), counts)
+    movie_ids = rng.choice(movies, size=len(user_ids), p=popularity).astype(np.int64) + 1
+    _, unique = np.unique(user_ids * (movies + 1) + movie_ids, return_index=True)
+    user_ids, movie_ids = user_ids[unique], movie_ids[unique]
+
+    quality = rng.normal(3.5, 0.5, size=movies + 1)
+    bias = rng.normal(0.0, 0.4, size=users + 1)
+    scores = quality[movie_ids] + bias[user_ids] + rng.normal(0.0, 0.8, size=len(user_ids))
+    ratings = np.clip(np.round(scores * 2) / 2, 0.5, 5.0)
+    timestamps = rng.integers(789652009, 1427784002, size=len(user_ids))
+    pd.DataFrame({
+        "userId": user_ids, "movieId": movie_ids, "rating": ratings, "timestamp": timestamps,
+    }).to_csv(os.path.join(directory, "ratings.csv"), index=False, float_format="%.1f")
+
+    tagged = rng.random(len(user_ids)) < 0.02
+    tags = pd.DataFrame({
+        "userId": user_ids[tagged],
+        "movieId": movie_ids[tagged],
+        "tag": [TAGS[i] for i in rng.integers(len(TAGS), size=int(tagged.sum()))],
+        "timestamp": timestamps[tagged],
+    })
+    tags.to_csv(os.path.join(directory, "tags.csv"), index=False)
+    print(f"Wrote {movies} movies and {len(user_ids)} ratings of {users} users to {directory}.")
+    return {"movies": movies, "users": users, "ratings": int(len(user_ids)), "tags": len(tags)}
+
+
+def synthetic_embeddings(catalog: SyntheticCatalog, column: str, noise: float = 0.6):
+    """
+    Unit vectors clustered by genre: the mean of the movie's genre centroids plus Gaussian noise,
+    so nearest neighbour searches behave like on real embeddings rather than on uniform noise.
+    """
+    dimensions = FULL_DIMENSIONS[column]
+    rng = np.random.default_rng([catalog.seed, zlib.crc32(column.encode())])
+    centroids = rng.normal(size=(len(GENRES), dimensions)).astype(np.float32)
+    movie_ids = np.fromiter(catalog.movie_ids(), dtype=np.int64)
+    matrix = rng.normal(scale=noise, size=(len(movie_ids), dimensions)).astype(np.float32)
+    for row, movie_id in enumerate(movie_ids):
+        genres = [GENRES.index(genre) for genre in catalog.movie(int(movie_id)).genres]
+        matrix[row] += centroids[genres].mean(axis=0)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return movie_ids, matrix
+
+
+def load_synthetic_embeddings(conn, catalog: SyntheticCatalog, columns=("clip_embedding", "openai_embedding")):
+    """
+    Upserts synthetic embeddings of the catalog into the given columns of movie_embeddings_table
+    through one COPY. Stands in for the CLIP (or OpenAI) stage when the real one can't run.
+    """
+    # db pulls in the API dependencies, which the CSV writer and the fake services don't need
+    from db import atomic, vector_literal
+
+    embeddings = {column: synthetic_embeddings(catalog, column)[1] for column in columns}
+    buffer = io.StringIO()
+    for row, movie_id in enumerate(catalog.movie_ids()):
+        buffer.write("\t".join([str(movie_id)] + [vector_literal(embeddings[column][row]) for column in columns]))
+        buffer.write("\n")
+    buffer.seek(0)
+    with atomic(conn), conn.cursor() as cur:
+        cur.execute("CREATE TEMPORARY TABLE synthetic_embeddings (LIKE movie_embeddings_table) ON COMMIT DROP")
+        cur.copy_expert(f"COPY synthetic_embeddings (id, {', '.join(columns)}) FROM STDIN", buffer)
+        cur.execute(f"""
+            INSERT INTO movie_embeddings_table (id, {', '.join(columns)})
+            SELECT id, {', '.join(columns)} FROM synthetic_embeddings
+            ON CONFLICT (id) DO UPDATE
+            SET {', '.join(f"{column} = EXCLUDED.{column}" for column in columns)}
+        """)
+    print(f"Loaded synthetic {', '.join(columns)} of {catalog.size} movies.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic MovieLens-shaped dataset")
+    parser.add_argument("directory")
+    parser.add_argument("--movies", type=int, default=27000)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--ratings-per-user", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_dataset(args.directory, args.movies, args.users, args.ratings_per_user, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,35 +1,387 @@
+import threading
+from contextlib import contextmanager
+
 from fastapi.exceptions import HTTPException
+from psycopg2 import extras, pool
+from pgvector.psycopg2 import register_vector
+from pgvector.psycopg import register_vector_async
+from psycopg_pool import AsyncConnectionPool
+
+from metrics import timed
+from vector_indexes import REDUCED_DIMENSIONS, reduced_column
+
+
+class VectorConnectionPool(pool.ThreadedConnectionPool):
+    """
+    Thread-safe psycopg2 pool that registers the pgvector type on every new connection
+    and makes getconn wait for a free connection instead of raising when the pool is exhausted.
+    """
+
+    def __init__(self, minconn, maxconn, *args, checkout_timeout: float = 30, **kwargs):
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._checkout_timeout = checkout_timeout
+        super().__init__(minconn, maxconn, *args, **kwargs)
+
+    def _connect(self, key=None):
+        conn = super()._connect(key)
+        register_vector(conn)
+        conn.commit()
+        return conn
+
+    def getconn(self, key=None):
+        if not self._slots.acquire(timeout=self._checkout_timeout):
+            raise pool.PoolError("timed out waiting for a free connection")
+        try:
+            return super().getconn(key)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        try:
+            super().putconn(conn, key, close)
+        finally:
+            self._slots.release()
+
+
+@contextmanager
+def atomic(conn):
+    """
+    Runs the block in one transaction on a psycopg2 connection, even if it's in autocommit mode.
+    Commits on success and rolls back on error.
+    """
+    autocommit = conn.autocommit
+    if autocommit:
+        conn.autocommit = False
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if autocommit:
+            conn.autocommit = True
+
+
+def create_connection_pool(dsn: str, minconn: int = 1, maxconn: int = 20):
+    return VectorConnectionPool(minconn=minconn, maxconn=maxconn, dsn=dsn)
+
+
+async def _configure_async_connection(conn):
+    await register_vector_async(conn)
+    await conn.commit()
+
+
+def create_async_pool(dsn: str, min_size: int = 2, max_size: int = 20, timeout: float = 30):
+    """
+    Creates a psycopg3 async pool with pgvector registered on every connection.
+    The pool is returned closed, open it with `await pool.open()` inside the running event loop.
+    """
+    return AsyncConnectionPool(
+        dsn,
+        min_size=min_size,
+        max_size=max_size,
+        timeout=timeout,
+        configure=_configure_async_connection,
+        open=False,
+    )
+
+
+MOVIES_METADATA_SQL = """
+    SELECT m.movieid, m.title, COALESCE(g.names, '{}'), l.imdbid, l.tmdbid
+    FROM movies m
+    LEFT JOIN links l ON l.movieid = m.movieid
+    LEFT JOIN LATERAL (
+        SELECT array_agg(genres.name ORDER BY genres.genre_id) AS names
+        FROM genres
+        WHERE genres.genre_id = ANY(m.genre_ids)
+    ) g ON TRUE
+    WHERE m.movieid = ANY(%s);
+"""
+
+SEARCH_MOVIES_SQL = """
+    SELECT movieid AS id
+    FROM movies
+    WHERE title <-> %s < %s
+    ORDER BY title <-> %s
+    LIMIT %s;
+"""
+
+STORED_METADATA_SQL = """
+    SELECT title, sinopsis, genres, poster_path, avg_rating, actors, tmdb_url
+    FROM movies_metadata
+    WHERE id = %s;
+"""
+
+UPSERT_METADATA_SQL = """
+    INSERT INTO movies_metadata
+    (id, title, sinopsis, genres, poster_path, avg_rating, actors, tmdb_url)
+    VALUES {values}
+    ON CONFLICT (id) DO UPDATE
+    SET title       = EXCLUDED.title,
+        sinopsis    = EXCLUDED.sinopsis,
+        genres      = EXCLUDED.genres,
+        poster_path = EXCLUDED.poster_path,
+        avg_rating  = EXCLUDED.avg_rating,
+        actors      = EXCLUDED.actors,
+        tmdb_url    = EXCLUDED.tmdb_url
+"""
+
 
 def get_movie_metadata(conn, movie_id: int):
-    with conn.cursor() as cur:
-        cur.execute(f"SELECT title, genre_ids FROM movies WHERE movieid = {movie_id}")
-        row = cur.fetchone()
-        if not row:
-            raise HTTPException(404, f"Movie {movie_id} not found")
-        title, genre_ids = row
+    movie = get_movies_metadata(conn, [movie_id]).get(movie_id)
+    if movie is None:
+        raise HTTPException(404, f"Movie {movie_id} not found")
+    return movie
+
+async def get_movie_metadata_async(conn, movie_id: int):
+    movie = (await get_movies_metadata_async(conn, [movie_id])).get(movie_id)
+    if movie is None:
+        raise HTTPException(404, f"Movie {movie_id} not found")
+    return movie
 
-        cur.execute("SELECT name FROM genres WHERE genre_id = ANY(%s)", (genre_ids,))
-        genres = [g[0] for g in cur.fetchall()]
+@timed("db")
+def get_movies_metadata(conn, movie_ids):
+    """
+    Resolves titles, genre names and links for a list of movie ids in a single query.
+    Returns a dict {movie_id: metadata}, ids that don't exist are left out.
+    """
+    if not movie_ids:
+        return {}
+    with conn.cursor() as cur:
+        cur.execute(MOVIES_METADATA_SQL, (list(movie_ids),))
+        return _movies_metadata_from_rows(cur.fetchall())
 
-        cur.execute(f"SELECT imdbid, tmdbid FROM links WHERE movieid = {movie_id}")
-        link = cur.fetchone()
-        imdbid, tmdbid = link if link else (None, None)
+@timed("db")
+async def get_movies_metadata_async(conn, movie_ids):
+    if not movie_ids:
+        return {}
+    async with conn.cursor() as cur:
+        await cur.execute(MOVIES_METADATA_SQL, (list(movie_ids),))
+        return _movies_metadata_from_rows(await cur.fetchall())
 
+def _movies_metadata_from_rows(rows):
     return {
-        "id":         movie_id,
-        "title":      title,
-        "genres":     genres,
-        "imdbid":     imdbid,
-        "tmdbid":     tmdbid
+        movie_id: {
+            "id":         movie_id,
+            "title":      title,
+            "genres":     list(genres),
+            "imdbid":     imdbid,
+            "tmdbid":     tmdbid
+        }
+        for movie_id, title, genres, imdbid, tmdbid in rows
     }
 
+@timed("db")
 def search_movies_by_title(conn, query, threshold=0.8, limit=10):
     with conn.cursor() as cur:
-        cur.execute("""
-            SELECT movieid AS id
-            FROM movies
-            WHERE title <-> %s < %s
-            ORDER BY title <-> %s
-            LIMIT %s;
-        """, (query, threshold, query, limit))
-        return [row[0] for row in cur.fetchall()]
\ No newline at end of file
+        cur.execute(SEARCH_MOVIES_SQL, (query, threshold, query, limit))
+        return [row[0] for row in cur.fetchall()]
+
+@timed("db")
+async def search_movies_by_title_async(conn, query, threshold=0.8, limit=10):
+    async with conn.cursor() as cur:
+        await cur.execute(SEARCH_MOVIES_SQL, (query, threshold, query, limit))
+        return [row[0] for row in await cur.fetchall()]
+
+
+RESOLVE_TITLES_SQL = """
+    SELECT q.ord - 1, m.movieid, 1 - m.distance
+    FROM unnest(%s::text[]) WITH ORDINALITY AS q(title, ord)
+    CROSS JOIN LATERAL (
+        SELECT movieid, title <-> q.title AS distance
+        FROM movies
+        ORDER BY title <-> q.title
+        LIMIT 1
+    ) m
+    WHERE m.distance < %s
+    ORDER BY q.ord;
+"""
+
+
+@timed("db")
+def resolve_movie_titles(conn, titles, threshold=0.6):
+    """
+    Fuzzy-matches every title against the catalog in one round trip, each with a KNN scan of the trigram index.
+    Returns (position in titles, movie id, similarity score) for the titles whose best match
+    is closer than `threshold` (a trigram distance, like in search_movies_by_title).
+    """
+    if not titles:
+        return []
+    with conn.cursor() as cur:
+        cur.execute(RESOLVE_TITLES_SQL, (list(titles), threshold))
+        return [(position, movie_id, float(score)) for position, movie_id, score in cur.fetchall()]
+
+@timed("db")
+async def resolve_movie_titles_async(conn, titles, threshold=0.6):
+    if not titles:
+        return []
+    async with conn.cursor() as cur:
+        await cur.execute(RESOLVE_TITLES_SQL, (list(titles), threshold))
+        return [(position, movie_id, float(score)) for position, movie_id, score in await cur.fetchall()]
+
+
+@timed("db")
+def get_stored_movie_metadata(conn, movie_id: int):
+    """
+    Reads the TMDB metadata stored for a movie in movies_metadata.
+    Returns None when the movie hasn't been harvested yet.
+    """
+    with conn.cursor() as cur:
+        cur.execute(STORED_METADATA_SQL, (movie_id,))
+        return _stored_metadata_from_row(cur.fetchone())
+
+@timed("db")
+async def get_stored_movie_metadata_async(conn, movie_id: int):
+    async with conn.cursor() as cur:
+        await cur.execute(STORED_METADATA_SQL, (movie_id,))
+        return _stored_metadata_from_row(await cur.fetchone())
+
+STORED_METADATAS_SQL = """
+    SELECT id, title, sinopsis, genres, poster_path, avg_rating, actors, tmdb_url
+    FROM movies_metadata
+    WHERE id = ANY(%s);
+"""
+
+@timed("db")
+def get_stored_movies_metadata(conn, movie_ids):
+    """
+    Bulk version of get_stored_movie_metadata: {movie_id: metadata} for the harvested movies among movie_ids.
+    """
+    if not movie_ids:
+        return {}
+    with conn.cursor() as cur:
+        cur.execute(STORED_METADATAS_SQL, (list(movie_ids),))
+        return {row[0]: _stored_metadata_from_row(row[1:]) for row in cur.fetchall()}
+
+@timed("db")
+async def get_stored_movies_metadata_async(conn, movie_ids):
+    if not movie_ids:
+        return {}
+    async with conn.cursor() as cur:
+        await cur.execute(STORED_METADATAS_SQL, (list(movie_ids),))
+        return {row[0]: _stored_metadata_from_row(row[1:]) for row in await cur.fetchall()}
+
+def _stored_metadata_from_row(row):
+    if not row:
+        return None
+    title, sinopsis, genres, poster_path, avg_rating, actors, tmdb_url = row
+    return {
+        "title":       title,
+        "sinopsis":    sinopsis,
+        "genres":      genres or [],
+        "poster_path": poster_path,
+        "avg_rating":  float(avg_rating) if avg_rating is not None else None,
+        "cast":        actors or [],
+        "tmdb_url":    tmdb_url
+    }
+
+
+@timed("db")
+def upsert_movies_metadata(cur, records):
+    """
+    Bulk upserts (movie_id, metadata) pairs into movies_metadata,
+    where metadata has the shape returned by tmdb.get_movie_full_metadata.
+    """
+    extras.execute_values(
+        cur,
+        UPSERT_METADATA_SQL.format(values="%s"),
+        [_metadata_record(movie_id, meta) for movie_id, meta in records]
+    )
+
+@timed("db")
+async def upsert_movies_metadata_async(cur, records):
+    await cur.executemany(
+        UPSERT_METADATA_SQL.format(values="(%s, %s, %s, %s, %s, %s, %s, %s)"),
+        [_metadata_record(movie_id, meta) for movie_id, meta in records]
+    )
+
+def _metadata_record(movie_id, meta):
+    return (
+        movie_id,
+        meta['title'],
+        meta['sinopsis'],
+        meta['genres'],
+        meta['poster_path'],
+        meta['avg_rating'],
+        meta['cast'],
+        meta['tmdb_url']
+    )
+
+
+UPSERT_EMBEDDINGS_SQL = """
+INSERT INTO movie_embeddings_table (id, {column})
+VALUES %s
+ON CONFLICT (id) DO UPDATE
+  SET {column} = EXCLUDED.{column}{reset_copies};
+"""
+
+
+def vector_literal(embedding) -> str:
+    """
+    pgvector text representation of a float sequence, works without a registered adapter.
+    """
+    return "[" + ",".join(f"{float(x):.7g}" for x in embedding) + "]"
+
+
+@timed("db")
+def upsert_embeddings(cur, column: str, rows):
+    """
+    Bulk upserts (movie_id, embedding) pairs into one embedding column of movie_embeddings_table
+    with a single statement per page. The reduced copies of a changed embedding are reset to NULL.
+    """
+    reset_copies = "".join(
+        f",\n      {reduced_column(column, dimensions)} = NULL" for dimensions in REDUCED_DIMENSIONS.get(column, ())
+    )
+    extras.execute_values(
+        cur,
+        UPSERT_EMBEDDINGS_SQL.format(column=column, reset_copies=reset_copies),
+        [(movie_id, vector_literal(embedding)) for movie_id, embedding in rows],
+        template="(%s, %s::vector)",
+        page_size=500,
+    )
+
+
+DATA_VERSION_SQL = "SELECT version FROM data_versions WHERE name = %s;"
+
+BUMP_DATA_VERSION_SQL = """
+    INSERT INTO data_versions (name, version, updated_at)
+    VALUES (%s, 1, NOW())
+    ON CONFLICT (name) DO UPDATE
+    SET version    = data_versions.version + 1,
+        updated_at = NOW()
+"""
+
+
+def bump_data_version(cur, name: str):
+    """
+    Marks the dataset `name` (e.g. "embeddings") as changed.
+    """
+    cur.execute(BUMP_DATA_VERSION_SQL, (name,))
+
+@timed("db")
+def get_data_version(conn, name: str) -> int:
+    with conn.cursor() as cur:
+        cur.execute(DATA_VERSION_SQL, (name,))
+        row = cur.fetchone()
+    return row[0] if row else 0
+
+@timed("db")
+async def get_data_version_async(conn, name: str) -> int:
+    async with conn.cursor() as cur:
+        await cur.execute(DATA_VERSION_SQL, (name,))
+        row = await cur.fetchone()
+    return row[0] if row else 0
+
+DATA_VERSIONS_SQL = "SELECT name, version FROM data_versions ORDER BY name;"
+
+@timed("db")
+async def get_data_versions_async(conn) -> dict:
+    """
+    Versions of every dataset, e.g. {"embeddings": 3, "ratings": 1}.
+    """
+    async with conn.cursor() as cur:
+        await cur.execute(DATA_VERSIONS_SQL)
+        rows = await cur.fetchall()
+    return {name: version for name, version in rows}
@@ -0,0 +1,317 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import TTLCache, MISSING
+from db import (
+    get_stored_movie_metadata,
+    get_stored_movie_metadata_async,
+    get_stored_movies_metadata,
+    get_stored_movies_metadata_async,
+    upsert_movies_metadata,
+    upsert_movies_metadata_async,
+)
+from tmdb import get_movie_full_metadata, get_movie_full_metadata_async, TMDB_IMAGE_BASE
+
+METADATA_CACHE_SIZE = int(os.getenv("METADATA_CACHE_SIZE", "10000"))
+METADATA_CACHE_TTL = float(os.getenv("METADATA_CACHE_TTL", str(24 * 3600)))
+# Movies without metadata (no tmdbid, or TMDB failed) are remembered briefly, so their pages don't wait on TMDB every time
+METADATA_NEGATIVE_TTL = float(os.getenv("METADATA_NEGATIVE_TTL", "300"))
+
+# data_versions entry bumped by `preprocess.py metadata` once the harvest stored new metadata
+METADATA_DATA_VERSION = "metadata"
+# Cached in place of the metadata of a movie that has none
+NOT_FOUND = object()
+# Concurrent TMDB requests of the sync bulk lookup, shared by every caller
+METADATA_FETCH_WORKERS = int(os.getenv("METADATA_FETCH_WORKERS", "16"))
+
+_fetch_executor = ThreadPoolExecutor(max_workers=METADATA_FETCH_WORKERS, thread_name_prefix="metadata")
+
+
+class MovieMetadataCache:
+    """
+    Read-through cache for TMDB movie metadata.
+
+    Lookups go through three layers:
+      1. an in-process LRU with TTL
+      2. the movies_metadata table filled by preprocess.load_movie_metadata
+      3. a live TMDB call, whose result is written back into movies_metadata
+    """
+
+    def __init__(self, maxsize: int = METADATA_CACHE_SIZE, ttl: float = METADATA_CACHE_TTL,
+                 negative_ttl: float = METADATA_NEGATIVE_TTL):
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.negative_ttl = negative_ttl
+        self.data_version = None
+        self.db_hits = 0
+        self.tmdb_fetches = 0
+        self.tmdb_errors = 0
+        self._lock = threading.Lock()
+
+    def get(self, conn, movie_id: int, tmdbid: int = None):
+        """
+        Returns the metadata dict (title, sinopsis, genres, poster_path, poster_url,
+        avg_rating, cast, tmdb_url) for movie_id, or None if it isn't available anywhere.
+        The returned dict is a copy, callers are free to modify it.
+        A movie without metadata is cached as such for `negative_ttl` seconds.
+        """
+        meta = self.memory.get(movie_id)
+        if meta is MISSING:
+            meta = self._load(conn, movie_id, tmdbid)
+            self._remember(movie_id, meta)
+        return None if meta is None or meta is NOT_FOUND else dict(meta)
+
+    async def get_async(self, conn, movie_id: int, tmdbid: int = None):
+        """
+        Same as `get`, for psycopg3 async connections. TMDB is queried with the shared httpx client.
+        """
+        meta = self.memory.get(movie_id)
+        if meta is MISSING:
+            meta = await self._load_async(conn, movie_id, tmdbid)
+            self._remember(movie_id, meta)
+        return None if meta is None or meta is NOT_FOUND else dict(meta)
+
+    def _remember(self, movie_id, meta):
+        if meta is None:
+            self.memory.set(movie_id, NOT_FOUND, ttl=self.negative_ttl)
+        else:
+            self.memory.set(movie_id, meta)
+
+    async def iter_many_async(self, conn, tmdb_ids: dict):
+        """
+        Yields (movie_id, metadata) for the movies of `tmdb_ids` ({movie_id: tmdbid}) as soon as each is known:
+        memory hits first, then the stored ones (one query), then the TMDB answers as they arrive,
+        fetched concurrently. `conn` is only used between the TMDB calls, so one connection serves
+        the whole batch. Movies without metadata anywhere aren't yielded.
+        """
+        missing = []
+        for movie_id in tmdb_ids:
+            meta = self.memory.get(movie_id)
+            if meta is MISSING:
+                missing.append(movie_id)
+            elif meta is not NOT_FOUND:
+                yield movie_id, dict(meta)
+        if not missing:
+            return
+
+        stored = await get_stored_movies_metadata_async(conn, missing)
+        for movie_id, meta in stored.items():
+            self._count("db_hits")
+            meta = _with_poster_url(meta)
+            self.memory.set(movie_id, meta)
+            yield movie_id, dict(meta)
+
+        async def fetch(movie_id):
+            try:
+                return movie_id, await get_movie_full_metadata_async(tmdb_ids[movie_id])
+            except (ConnectionError, RuntimeError) as e:
+                self._count("tmdb_errors")
+                print(e)
+                return movie_id, None
+
+        to_fetch = []
+        for movie_id in missing:
+            if movie_id in stored:
+                continue
+            if tmdb_ids[movie_id]:
+                to_fetch.append(movie_id)
+            else:
+                self._remember(movie_id, None)
+        fetched = []
+        tasks = [asyncio.ensure_future(fetch(movie_id)) for movie_id in to_fetch]
+        try:
+            for task in asyncio.as_completed(tasks):
+                movie_id, meta = await task
+                self._count("tmdb_fetches")
+                if meta is None:
+                    self._remember(movie_id, None)
+                    continue
+                fetched.append((movie_id, meta))
+                meta = _with_poster_url(dict(meta))
+                self.memory.set(movie_id, meta)
+                yield movie_id, dict(meta)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        if fetched:
+            try:
+                async with conn.transaction():
+                    async with conn.cursor() as cur:
+                        await upsert_movies_metadata_async(cur, fetched)
+            except Exception as e:
+                print(f"Couldn't store metadata for {len(fetched)} movies: {e}")
+
+    def get_many(self, conn, tmdb_ids: dict) -> dict:
+        """
+        Sync counterpart of iter_many_async: {movie_id: metadata} for the movies of `tmdb_ids`
+        ({movie_id: tmdbid}) that have metadata, with one query for the stored ones
+        and the TMDB misses fetched concurrently.
+        """
+        found = {}
+        missing = []
+        for movie_id in tmdb_ids:
+            meta = self.memory.get(movie_id)
+            if meta is MISSING:
+                missing.append(movie_id)
+            elif meta is not NOT_FOUND:
+                found[movie_id] = dict(meta)
+        if not missing:
+            return found
+
+        stored = get_stored_movies_metadata(conn, missing)
+        for movie_id, meta in stored.items():
+            self._count("db_hits")
+            meta = _with_poster_url(meta)
+            self.memory.set(movie_id, meta)
+            found[movie_id] = dict(meta)
+
+        def fetch(movie_id):
+            try:
+                return get_movie_full_metadata(tmdb_ids[movie_id])
+            except (ConnectionError, RuntimeError) as e:
+                self._count("tmdb_errors")
+                print(e)
+                return None
+
+        to_fetch = []
+        for movie_id in missing:
+            if movie_id in stored:
+                continue
+            if tmdb_ids[movie_id]:
+                to_fetch.append(movie_id)
+            else:
+                self._remember(movie_id, None)
+        fetched = []
+        for movie_id, meta in zip(to_fetch, _fetch_executor.map(fetch, to_fetch)):
+            self._count("tmdb_fetches")
+            if meta is None:
+                self._remember(movie_id, None)
+                continue
+            fetched.append((movie_id, meta))
+            meta = _with_poster_url(dict(meta))
+            self.memory.set(movie_id, meta)
+            found[movie_id] = dict(meta)
+
+        if fetched:
+            try:
+                with conn.cursor() as cur:
+                    upsert_movies_metadata(cur, fetched)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                print(f"Couldn't store metadata for {len(fetched)} movies: {e}")
+        return found
+
+    def get_poster_urls(self, conn, tmdb_ids: dict) -> dict:
+        """
+        {movie_id: poster URL or None} for every movie of `tmdb_ids`, looked up in bulk.
+        """
+        found = self.get_many(conn, tmdb_ids)
+        return {movie_id: (found.get(movie_id) or {}).get('poster_url') for movie_id in tmdb_ids}
+
+    async def get_poster_urls_async(self, conn, tmdb_ids: dict) -> dict:
+        poster_urls = dict.fromkeys(tmdb_ids)
+        async for movie_id, meta in self.iter_many_async(conn, tmdb_ids):
+            poster_urls[movie_id] = meta.get('poster_url')
+        return poster_urls
+
+    def get_poster_url(self, conn, movie_id: int, tmdbid: int = None):
+        meta = self.get(conn, movie_id, tmdbid)
+        return meta['poster_url'] if meta else None
+
+    async def get_poster_url_async(self, conn, movie_id: int, tmdbid: int = None):
+        meta = await self.get_async(conn, movie_id, tmdbid)
+        return meta['poster_url'] if meta else None
+
+    def _load(self, conn, movie_id, tmdbid):
+        meta = get_stored_movie_metadata(conn, movie_id)
+        if meta is not None:
+            self._count("db_hits")
+            return _with_poster_url(meta)
+
+        if not tmdbid:
+            return None
+
+        self._count("tmdb_fetches")
+        try:
+            meta = get_movie_full_metadata(tmdbid)
+        except (ConnectionError, RuntimeError) as e:
+            self._count("tmdb_errors")
+            print(e)
+            return None
+
+        try:
+            with conn.cursor() as cur:
+                upsert_movies_metadata(cur, [(movie_id, meta)])
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"Couldn't store metadata for movie {movie_id}: {e}")
+        return _with_poster_url(meta)
+
+    async def _load_async(self, conn, movie_id, tmdbid):
+        meta = await get_stored_movie_metadata_async(conn, movie_id)
+        if meta is not None:
+            self._count("db_hits")
+            return _with_poster_url(meta)
+
+        if not tmdbid:
+            return None
+
+        self._count("tmdb_fetches")
+        try:
+            meta = await get_movie_full_metadata_async(tmdbid)
+        except (ConnectionError, RuntimeError) as e:
+            self._count("tmdb_errors")
+            print(e)
+            return None
+
+        try:
+            async with conn.transaction():
+                async with conn.cursor() as cur:
+                    await upsert_movies_metadata_async(cur, [(movie_id, meta)])
+        except Exception as e:
+            print(f"Couldn't store metadata for movie {movie_id}: {e}")
+        return _with_poster_url(meta)
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def invalidate(self, movie_id: int = None):
+        if movie_id is None:
+            self.memory.clear()
+        else:
+            self.memory.pop(movie_id)
+
+    def set_data_version(self, version) -> bool:
+        """
+        Drops every cached entry, the movies without metadata included, when the harvest
+        stored new metadata since the last call. Returns whether it did.
+        """
+        changed = version != self.data_version
+        if changed:
+            self.invalidate()
+        self.data_version = version
+        return changed
+
+    def stats(self) -> dict:
+        stats = self.memory.stats()
+        stats.update({
+            "data_version": self.data_version,
+            "db_hits": self.db_hits,
+            "tmdb_fetches": self.tmdb_fetches,
+            "tmdb_errors": self.tmdb_errors,
+        })
+        return stats
+
+
+def _with_poster_url(meta):
+    poster_path = meta.get('poster_path')
+    meta['poster_url'] = f"{TMDB_IMAGE_BASE}{poster_path}" if poster_path else None
+    return meta
+
+
+metadata_cache = MovieMetadataCache()
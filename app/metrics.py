@@ -0,0 +1,258 @@
+import contextvars
+import inspect
+import os
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+# Timing is cheap (two perf_counter calls and a locked counter update per span), it's on by default
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "1") != "0"
+
+# Upper bounds in seconds, from a cached index lookup to an LLM answer
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# {span name: [seconds, calls]} of the request being served, None outside of a request.
+# Tasks and threads started by the request get a copy of the context, so they add to the same dict.
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+class Histogram:
+    """
+    Thread-safe Prometheus histogram with one series per combination of label values.
+    """
+
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (the last one is +Inf), sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bucket] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        with self._lock:
+            series = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items()]
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, counts, total, count in sorted(series):
+            labels = _labels(self.labels, label_values)
+            prefix = f"{labels}," if labels else ""
+            cumulative = 0
+            for upper, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{upper}"}} {cumulative}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {count}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram(
+    "movielens_http_request_seconds", "Time to the end of the response, by route template and status.",
+    ("method", "route", "status"),
+)
+SPAN_SECONDS = Histogram(
+    "movielens_span_seconds", "Duration of the DB queries, outbound calls and rendering steps.", ("kind", "name"),
+)
+ALGORITHM_SECONDS = Histogram(
+    "movielens_algorithm_seconds", "Time until a recommender answered, failed or missed its deadline.",
+    ("algorithm", "status"),
+)
+HISTOGRAMS = [REQUEST_SECONDS, SPAN_SECONDS, ALGORITHM_SECONDS]
+
+
+def _add_request_timing(name, seconds):
+    timings = _request_timings.get()
+    if timings is not None:
+        entry = timings.get(name)
+        if entry is None:
+            timings[name] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+
+def record(kind: str, name: str, seconds: float):
+    """
+    Adds a finished span to the histograms and to the Server-Timing header of the current request.
+    """
+    if not METRICS_ENABLED:
+        return
+    SPAN_SECONDS.observe(seconds, kind, name)
+    _add_request_timing(f"{kind}.{name}", seconds)
+
+
+def record_algorithm(algorithm: str, status: str, seconds: float):
+    if not METRICS_ENABLED:
+        return
+    ALGORITHM_SECONDS.observe(seconds, algorithm, status)
+    _add_request_timing(f"algorithm.{algorithm}", seconds)
+
+
+class span:
+    """
+    Times a block as `kind.name`, e.g. `with span("db", "clip_neighbours"):`.
+    Also works as an async context manager, so it can share an `async with` statement with a cursor.
+    """
+
+    __slots__ = ("kind", "name", "started")
+
+    def __init__(self, kind: str, name: str):
+        self.kind = kind
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.kind, self.name, time.perf_counter() - self.started)
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc):
+        self.__exit__(*exc)
+
+
+def timed(kind: str, name: str = None):
+    """
+    Decorator timing every call of a function as a span. The name defaults to the function name
+    without its `_async` suffix, so both variants of a helper land in the same series.
+    """
+    def decorator(func):
+        if not METRICS_ENABLED:
+            return func
+        span_name = name or func.__name__.removesuffix("_async")
+
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    record(kind, span_name, time.perf_counter() - started)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(kind, span_name, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def server_timing_header(timings: dict, total: float) -> str:
+    """
+    `Server-Timing` value of a request: one entry per span name with the summed duration in ms.
+    Spans run concurrently (e.g. the algorithms), so the entries can add up to more than `total`.
+    """
+    entries = []
+    for name, (seconds, calls) in sorted(timings.items(), key=lambda item: -item[1][0]):
+        entry = f"{name};dur={seconds * 1000:.1f}"
+        if calls > 1:
+            entry += f';desc="{calls} calls"'
+        entries.append(entry)
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request by route template and adding a Server-Timing header
+    with the spans recorded while the response was prepared. Spans recorded while a streaming body
+    is being sent come after the headers, they only reach the histograms.
+    """
+
+    def __init__(self, app, server_timing: bool = SERVER_TIMING_ENABLED):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            return await self.app(scope, receive, send)
+
+        timings = {}
+        token = _request_timings.set(timings)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    header = server_timing_header(timings, time.perf_counter() - started)
+                    message = dict(message, headers=[*message.get("headers", []),
+                                                     (b"server-timing", header.encode("latin-1"))])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+            # The router stores the matched route in the scope, unmatched paths share one series
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_SECONDS.observe(time.perf_counter() - started, scope["method"], route, str(status))
+
+
+def render_stats(prefix: str, stats: dict, label: str = None) -> list:
+    """
+    Gauges from stats() dicts. `stats` is either {stat: value}, or {label value: {stat: value}}
+    with `label` naming the label, e.g. render_stats("movielens_cache", {"tmdb": {...}}, "cache").
+    Non-numeric stats are left out, booleans become 0 or 1.
+    """
+    series = stats.items() if label else [(None, stats)]
+    by_stat = {}
+    for label_value, values in series:
+        for stat, value in values.items():
+            if isinstance(value, bool):
+                value = int(value)
+            if isinstance(value, (int, float)):
+                by_stat.setdefault(stat, []).append((label_value, value))
+    lines = []
+    for stat, samples in by_stat.items():
+        name = f"{prefix}_{stat}"
+        lines.append(f"# TYPE {name} gauge")
+        for label_value, value in samples:
+            labels = f'{{{label}="{_escape(label_value)}"}}' if label else ""
+            lines.append(f"{name}{labels} {value}")
+    return lines
+
+
+def render(*extra_lines) -> str:
+    """
+    Prometheus text exposition of the histograms, followed by `extra_lines` (e.g. from render_stats).
+    """
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    for chunk in extra_lines:
+        lines.extend(chunk)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,17 @@
+# Shared by the request path (recommendations.py) and the offline job (neighbours_processor.py),
+# kept free of their dependencies so the job doesn't load the API clients
+
+# Default clip weight of the weighted algorithm, openai gets 1 - alpha
+WEIGHTED_ALPHA = 0.3
+# Number of neighbours neighbours_processor materialises per movie and algorithm
+NEIGHBOURS_TOP_K = 20
+
+
+def neighbour_table_key(algorithm: str, alpha: float = WEIGHTED_ALPHA):
+    """
+    Name under which an algorithm's neighbours are stored in similar_embedding_movies.
+    The weighted neighbours depend on alpha, so it's part of the key.
+    """
+    if algorithm == "weighted":
+        return f"weighted:{alpha:g}"
+    return algorithm
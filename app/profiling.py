@@ -0,0 +1,210 @@
+import asyncio
+import hmac
+import itertools
+import os
+import re
+import threading
+import time
+from urllib.parse import parse_qs
+
+# Shared secret of on-demand profiles: send it as the X-Profile header or the `profile` query parameter.
+# Unset disables on-demand profiling.
+PROFILE_SECRET = os.getenv("PROFILE_SECRET", "")
+# Profile one in every N requests into PROFILE_DIR, 0 disables sampling
+PROFILE_SAMPLE_EVERY = int(os.getenv("PROFILE_SAMPLE_EVERY", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles"))
+# The oldest profiles are deleted once the directory holds more than this
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+PROFILE_SAMPLE_FORMAT = os.getenv("PROFILE_SAMPLE_FORMAT", "speedscope")
+# Seconds between two stack samples
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.001"))
+
+# html: pyinstrument's interactive call tree, speedscope: a flame graph for https://www.speedscope.app
+PROFILE_FORMATS = {
+    "html": ("text/html; charset=utf-8", "html"),
+    "speedscope": ("application/json", "speedscope.json"),
+}
+
+_profiling = threading.Lock()
+
+
+def start_profiler(interval: float = PROFILE_INTERVAL):
+    """
+    Starts a pyinstrument profiler following the current async task, or returns None when
+    pyinstrument isn't installed or another request is being profiled (one profiler per thread).
+    """
+    try:
+        # Optional dependency, only needed when profiling is used
+        from pyinstrument import Profiler
+    except ImportError:
+        print("Profiling requested but pyinstrument isn't installed: pip install pyinstrument")
+        return None
+    if not _profiling.acquire(blocking=False):
+        return None
+    try:
+        profiler = Profiler(interval=interval, async_mode="enabled")
+        profiler.start()
+    except Exception:
+        _profiling.release()
+        raise
+    return profiler
+
+
+def stop_profiler(profiler):
+    try:
+        profiler.stop()
+    finally:
+        _profiling.release()
+
+
+def render_profile(profiler, format: str) -> str:
+    if format == "speedscope":
+        from pyinstrument.renderers import SpeedscopeRenderer
+
+        return profiler.output(SpeedscopeRenderer())
+    return profiler.output_html()
+
+
+class ProfileStore:
+    """
+    Bounded on-disk ring buffer of profiles: file names start with a timestamp,
+    and every write deletes the oldest files beyond `max_files`.
+    """
+
+    def __init__(self, directory: str = PROFILE_DIR, max_files: int = PROFILE_MAX_FILES):
+        self.directory = directory
+        self.max_files = max_files
+        self._lock = threading.Lock()
+
+    def save(self, name: str, content: str) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{int(time.time() * 1000):013d}-{name}")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        with self._lock:
+            files = sorted(os.listdir(self.directory))
+            for stale in files[:max(0, len(files) - self.max_files)]:
+                try:
+                    os.remove(os.path.join(self.directory, stale))
+                except FileNotFoundError:
+                    pass
+        return path
+
+
+def _profile_name(scope, status, seconds, extension):
+    path = re.sub(r"[^A-Za-z0-9]+", "_", scope["path"]).strip("_")[:60] or "root"
+    return f"{scope['method']}-{path}-{status}-{seconds * 1000:.0f}ms.{extension}"
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware wrapping single requests in a sampling profiler.
+
+    On demand: a request carrying the shared secret (X-Profile header or `profile` query parameter)
+    is answered with its profile instead of its response, as HTML or as a speedscope flame graph
+    (X-Profile-Format header or `profile_format` query parameter). The original status is in X-Profiled-Status.
+    Sampling: one in every `sample_every` requests is profiled in the background of a normal response
+    and written into the ring buffer of `store`.
+    """
+
+    def __init__(self, app, secret: str = PROFILE_SECRET, sample_every: int = PROFILE_SAMPLE_EVERY,
+                 store: ProfileStore = None, sample_format: str = PROFILE_SAMPLE_FORMAT):
+        if sample_format not in PROFILE_FORMATS:
+            raise ValueError(f"Unknown profile format {sample_format!r}, expected one of {list(PROFILE_FORMATS)}")
+        self.app = app
+        self.secret = secret
+        self.sample_every = sample_every
+        self.store = store or ProfileStore()
+        self.sample_format = sample_format
+        self._requests = itertools.count(1)
+        self._writes = set()
+
+    def _requested_format(self, scope):
+        """
+        The profile format asked for by the request, or None when it didn't ask with the right secret.
+        """
+        if not self.secret:
+            return None
+        headers = dict(scope["headers"])
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        secret = headers.get(b"x-profile", b"").decode("latin-1") or query.get("profile", [""])[0]
+        # Bytes: compare_digest raises TypeError for non-ASCII str, which a crafted header could send
+        if not secret or not hmac.compare_digest(secret.encode("utf-8"), self.secret.encode("utf-8")):
+            return None
+        format = headers.get(b"x-profile-format", b"").decode("latin-1") or query.get("profile_format", ["html"])[0]
+        return format if format in PROFILE_FORMATS else "html"
+
+    def _sampled(self) -> bool:
+        return self.sample_every > 0 and next(self._requests) % self.sample_every == 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        format = self._requested_format(scope)
+        if format is not None:
+            return await self._profile_on_demand(scope, receive, send, format)
+        if self._sampled():
+            return await self._profile_sample(scope, receive, send)
+        await self.app(scope, receive, send)
+
+    async def _profile_on_demand(self, scope, receive, send, format):
+        profiler = start_profiler()
+        if profiler is None:
+            return await _send_text(send, 503, "Profiling is unavailable: another request is being profiled, "
+                                                 "or pyinstrument is missing (pip install pyinstrument)")
+        status = 500
+
+        async def discard(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        try:
+            await self.app(scope, receive, discard)
+        finally:
+            stop_profiler(profiler)
+        content_type, _ = PROFILE_FORMATS[format]
+        body = await asyncio.to_thread(render_profile, profiler, format)
+        await _send_text(send, 200, body, content_type, [(b"x-profiled-status", str(status).encode())])
+
+    async def _profile_sample(self, scope, receive, send):
+        profiler = start_profiler()
+        if profiler is None:
+            # Another request is being profiled, this one isn't worth waiting for
+            return await self.app(scope, receive, send)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            stop_profiler(profiler)
+            _, extension = PROFILE_FORMATS[self.sample_format]
+            name = _profile_name(scope, status, time.perf_counter() - started, extension)
+            # Rendering and writing happen after the response, off the event loop
+            task = asyncio.create_task(asyncio.to_thread(self._write, profiler, name))
+            self._writes.add(task)
+            task.add_done_callback(self._writes.discard)
+
+    def _write(self, profiler, name):
+        try:
+            self.store.save(name, render_profile(profiler, self.sample_format))
+        except Exception as e:
+            print(f"Couldn't store the profile {name}: {e}")
+
+
+async def _send_text(send, status, body, content_type="text/plain; charset=utf-8", headers=()):
+    body = body.encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode()),
+                    (b"cache-control", b"no-store"), *headers],
+    })
+    await send({"type": "http.response.body", "body": body})
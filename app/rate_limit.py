@@ -0,0 +1,63 @@
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter: `rate` tokens per second refill a bucket of `capacity` tokens.
+
+    Usable from threads (acquire) and from coroutines (acquire_async). A request for more tokens
+    than the capacity is allowed once the bucket is full, so oversized requests aren't starved.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def per_minute(cls, amount: float, burst: float = None):
+        return cls(amount / 60.0, burst if burst is not None else amount)
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _take(self, tokens) -> float:
+        """
+        Takes the tokens if available and returns 0, otherwise returns the seconds to wait.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            needed = min(tokens, self.capacity)
+            if self._tokens >= needed:
+                self._tokens -= tokens
+                return 0.0
+            return (needed - self._tokens) / self.rate
+
+    def acquire(self, tokens: float = 1):
+        while True:
+            wait = self._take(tokens)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: float = 1):
+        while True:
+            wait = self._take(tokens)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def penalize(self, seconds: float):
+        """
+        Empties the bucket for `seconds`, e.g. after the server answered 429 with Retry-After.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, 0.0) - seconds * self.rate
@@ -1,177 +1,659 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
 import psycopg2
 
-from db import get_movie_metadata
-from tmdb import get_poster_path
+from db import get_movie_metadata, get_movie_metadata_async, get_movies_metadata, get_movies_metadata_async
+from metadata_cache import metadata_cache
 
-from openai_processor import get_chatgpt_predictions
-from db import search_movies_by_title
+from openai_processor import get_chatgpt_predictions, get_chatgpt_predictions_async
+from db import atomic
+from llm_cache import (
+    get_cached_recommendations,
+    get_cached_recommendations_async,
+    resolve_titles,
+    resolve_titles_async,
+    store_recommendations,
+    store_recommendations_async,
+)
+from vector_indexes import (
+    SET_EF_SEARCH_SQL,
+    VECTOR_STORAGE,
+    VECTOR_STORAGES,
+    ef_search_for,
+    quantized_expression,
+    reduced_column,
+)
+from memory_index import memory_index, VECTOR_BACKEND
+from metrics import record_algorithm, span, timed
+from neighbours import NEIGHBOURS_TOP_K, WEIGHTED_ALPHA, neighbour_table_key
 
 SUPPORTED_ALGORITHMS = ["dummy", "clip", "openai", "ratings", "chatgpt", "weighted"]
 
-def prepare_recommendations(conn, movie_id, algorithms):
+# The weighted distance can't be served by an HNSW index, so by default it reranks the union
+# of the top WEIGHTED_CANDIDATES clip and openai neighbours ("rerank") instead of scanning every row ("exact")
+WEIGHTED_SEARCH_MODE = os.getenv("WEIGHTED_SEARCH_MODE", "rerank")
+WEIGHTED_CANDIDATES = int(os.getenv("WEIGHTED_CANDIDATES", "100"))
+
+# Shortlist size of a quantised (VECTOR_STORAGE=halfvec|binary) search, reranked by the exact distance.
+# Binary codes lose more, they need a longer shortlist for the same recall.
+QUANTIZED_CANDIDATES = {
+    "halfvec": int(os.getenv("HALFVEC_CANDIDATES", "40")),
+    "binary": int(os.getenv("BINARY_CANDIDATES", "200")),
+}
+
+# Size of the embeddings searched by the live clip / openai queries, unset for the full vectors.
+# The reduced copies make the index and every distance several times cheaper at a small recall cost.
+# A reduced size also bypasses the materialised neighbours, which are computed on the full vectors.
+CLIP_SEARCH_DIMENSIONS = int(os.getenv("CLIP_SEARCH_DIMENSIONS", "0")) or None
+OPENAI_SEARCH_DIMENSIONS = int(os.getenv("OPENAI_SEARCH_DIMENSIONS", "0")) or None
+
+# Seconds an algorithm may take before its slot is rendered as "pending"
+DEFAULT_DEADLINE = float(os.getenv("RECOMMENDATION_DEADLINE", "3"))
+ALGORITHM_DEADLINES = {
+    "chatgpt": float(os.getenv("CHATGPT_RECOMMENDATION_DEADLINE", "10")),
+}
+
+# Algorithms that compute cache misses in the background of the async API, they get the pool as `db_pool`
+BACKGROUND_ALGORITHMS = {"chatgpt"}
+
+
+class RecommendationPending(Exception):
+    """
+    Raised by a recommender whose result is being computed in the background,
+    its slot is rendered as "pending".
+    """
+
+
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("RECOMMENDATION_WORKERS", "16")),
+    thread_name_prefix="recommender",
+)
+
+
+def prepare_recommendations(db_pool, movie_id, algorithms, deadlines=None, options=None):
+    """
+    Runs every algorithm concurrently, each on its own pooled connection.
+
+    Returns (recommendations, timings):
+      - recommendations has one slot per algorithm, in the order of `algorithms`.
+        A slot is an empty list when the algorithm failed or missed its deadline,
+        so the slot index always matches the algorithm index.
+      - timings maps algorithm -> {"status": "ok" | "error" | "pending", "seconds": float}
+    `options` maps algorithm -> extra keyword arguments for that algorithm, e.g. {"weighted": {"alpha": 0.5}}.
+    """
+    deadlines = {**ALGORITHM_DEADLINES, **(deadlines or {})}
+    options = options or {}
+    started = time.perf_counter()
+    futures = [
+        _executor.submit(_run_algorithm, db_pool, movie_id, method, options.get(method, {}))
+        for method in algorithms
+    ]
+
     recommendations = []
-    for method in algorithms:
+    timings = {}
+    for method, future in zip(algorithms, futures):
+        deadline = deadlines.get(method, DEFAULT_DEADLINE)
+        remaining = max(0.0, started + deadline - time.perf_counter())
         try:
-            recommendation_ids = get_recommendations(conn, movie_id, method)
+            algorithm_recommendations, seconds = future.result(timeout=remaining)
+            timings[method] = {"status": "ok", "seconds": seconds}
+        except TimeoutError:
+            # The worker keeps running and returns its connection once it's done
             algorithm_recommendations = []
-            for rec_id in recommendation_ids:
-                rec_metadata = get_movie_metadata(conn, rec_id)
-                rec_poster_url = None
-                if rec_metadata.get('tmdbid'):
-                    rec_poster_url = get_poster_path(rec_metadata.get('tmdbid'))
-                algorithm_recommendations.append(
-                    {   
-                        'movie_id': rec_id,
-                        'title': rec_metadata.get('title'),
-                        'poster_url': rec_poster_url
-                    }
-                )
-            recommendations.append(algorithm_recommendations)
+            timings[method] = {"status": "pending", "seconds": time.perf_counter() - started}
         except Exception as e:
-            print(e)
+            print(f"Algorithm {method} failed for movie {movie_id}: {e}")
+            algorithm_recommendations = []
+            timings[method] = {"status": "error", "seconds": time.perf_counter() - started}
+        record_algorithm(method, timings[method]["status"], timings[method]["seconds"])
+        recommendations.append(algorithm_recommendations)
+    return recommendations, timings
+
+def _run_algorithm(db_pool, movie_id, method, options):
+    conn = db_pool.getconn()
+    try:
+        started = time.perf_counter()
+        algorithm_recommendations = prepare_algorithm_recommendations(conn, movie_id, method, **options)
+        return algorithm_recommendations, time.perf_counter() - started
+    finally:
+        db_pool.putconn(conn)
+
+def prepare_algorithm_recommendations(conn, movie_id, method, **options):
+    """
+    Runs a single algorithm and resolves titles and poster URLs of the recommended movies.
+    """
+    recommendation_ids = get_recommendations(conn, movie_id, method, **options)
+    recommendations_metadata = get_movies_metadata(conn, recommendation_ids)
+    # One stored-metadata query for all the posters, the TMDB misses are fetched concurrently
+    poster_urls = metadata_cache.get_poster_urls(conn, _tmdb_ids(recommendations_metadata))
+    return _algorithm_recommendations(recommendation_ids, recommendations_metadata, poster_urls)
+
+def _tmdb_ids(recommendations_metadata):
+    return {rec_id: rec_metadata.get('tmdbid') for rec_id, rec_metadata in recommendations_metadata.items()}
+
+def _algorithm_recommendations(recommendation_ids, recommendations_metadata, poster_urls):
+    algorithm_recommendations = []
+    for rec_id in recommendation_ids:
+        rec_metadata = recommendations_metadata.get(rec_id)
+        if rec_metadata is None:
             continue
-    return recommendations
+        algorithm_recommendations.append(
+            {
+                'movie_id': rec_id,
+                'title': rec_metadata.get('title'),
+                'poster_url': poster_urls.get(rec_id)
+            }
+        )
+    return algorithm_recommendations
+
+async def prepare_recommendations_async(db_pool, movie_id, algorithms, deadlines=None, options=None):
+    """
+    Async counterpart of `prepare_recommendations` for a psycopg3 AsyncConnectionPool.
+    Each algorithm runs as its own task on its own pooled connection, the return value has the same shape.
+    """
+    deadlines = {**ALGORITHM_DEADLINES, **(deadlines or {})}
+    options = options or {}
+    started = time.perf_counter()
+    tasks = [
+        asyncio.create_task(_run_algorithm_async(db_pool, movie_id, method, options.get(method, {})))
+        for method in algorithms
+    ]
+
+    recommendations = []
+    timings = {}
+    for method, task in zip(algorithms, tasks):
+        deadline = deadlines.get(method, DEFAULT_DEADLINE)
+        remaining = max(0.0, started + deadline - time.perf_counter())
+        await asyncio.wait({task}, timeout=remaining)
+        if task.done() and isinstance(task.exception(), RecommendationPending):
+            algorithm_recommendations = []
+            timings[method] = {"status": "pending", "seconds": time.perf_counter() - started}
+        elif not task.done():
+            # Leave the task running in the background, it releases its connection when done
+            _background_tasks.add(task)
+            task.add_done_callback(_discard_background_task)
+            algorithm_recommendations = []
+            timings[method] = {"status": "pending", "seconds": time.perf_counter() - started}
+        elif task.exception() is not None:
+            print(f"Algorithm {method} failed for movie {movie_id}: {task.exception()}")
+            algorithm_recommendations = []
+            timings[method] = {"status": "error", "seconds": time.perf_counter() - started}
+        else:
+            algorithm_recommendations, seconds = task.result()
+            timings[method] = {"status": "ok", "seconds": seconds}
+        record_algorithm(method, timings[method]["status"], timings[method]["seconds"])
+        recommendations.append(algorithm_recommendations)
+    return recommendations, timings
 
-def get_recommendations(conn, movie_id: int, algorithm: str):
+_background_tasks = set()
+
+def _discard_background_task(task):
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Background recommendation task failed: {task.exception()}")
+
+async def _run_algorithm_async(db_pool, movie_id, method, options):
+    if method in BACKGROUND_ALGORITHMS:
+        options = dict(options, db_pool=db_pool)
+    async with db_pool.connection() as conn:
+        started = time.perf_counter()
+        algorithm_recommendations = await prepare_algorithm_recommendations_async(conn, movie_id, method, **options)
+        return algorithm_recommendations, time.perf_counter() - started
+
+async def prepare_algorithm_recommendations_async(conn, movie_id, method, **options):
+    recommendation_ids = await get_recommendations_async(conn, movie_id, method, **options)
+    recommendations_metadata = await get_movies_metadata_async(conn, recommendation_ids)
+    poster_urls = await metadata_cache.get_poster_urls_async(conn, _tmdb_ids(recommendations_metadata))
+    return _algorithm_recommendations(recommendation_ids, recommendations_metadata, poster_urls)
+
+def get_recommendations(conn, movie_id: int, algorithm: str, **options):
+    """
+    Dispatches to the recommender of `algorithm`, `options` are forwarded to it as keyword arguments.
+    With VECTOR_BACKEND=memory the embedding-based algorithms are answered by the in-memory index.
+    """
+    if algorithm not in SUPPORTED_ALGORITHMS:
+        raise KeyError(f"Provided algorithm {algorithm} is not supported. Supported list of algorithms: {SUPPORTED_ALGORITHMS}")
+    if memory_index_answers(algorithm, options):
+        return _memory_search(movie_id, algorithm, **options)
+    if algorithm == 'dummy':
+        return get_dummy_recommendations(movie_id, **options)
+    elif algorithm == "clip":
+        return get_clip_recommendations(conn, movie_id, **options)
+    elif algorithm == "ratings":
+        return get_rating_item2item_recommendation(conn, movie_id, **options)
+    elif algorithm == 'chatgpt':
+        return get_chatgpt_recommendations(conn, movie_id, **options)
+    elif algorithm == 'openai':
+        return get_openai_recommendations(conn, movie_id, **options)
+    elif algorithm == 'weighted':
+        return get_clip_and_openai_recommendations(conn, movie_id, **options)
+    else:
+        raise KeyError(f"Provided algorithm {algorithm} is not supported. Supported list of algorithms: {SUPPORTED_ALGORITHMS}")
+
+async def get_recommendations_async(conn, movie_id: int, algorithm: str, **options):
     if algorithm not in SUPPORTED_ALGORITHMS:
         raise KeyError(f"Provided algorithm {algorithm} is not supported. Supported list of algorithms: {SUPPORTED_ALGORITHMS}")
+    if memory_index_answers(algorithm, options):
+        # NumPy releases the GIL, so the search runs in a worker thread without blocking the loop
+        return await asyncio.to_thread(_memory_search, movie_id, algorithm, **options)
     if algorithm == 'dummy':
-        return get_dummy_recommendations(movie_id)
+        return get_dummy_recommendations(movie_id, **options)
     elif algorithm == "clip":
-        return get_clip_recommendations(conn, movie_id)
+        return await get_clip_recommendations_async(conn, movie_id, **options)
     elif algorithm == "ratings":
-        return get_rating_item2item_recommendation(conn, movie_id)
+        return await get_rating_item2item_recommendation_async(conn, movie_id, **options)
     elif algorithm == 'chatgpt':
-        return get_chatgpt_recommendations(conn, movie_id)
+        return await get_chatgpt_recommendations_async(conn, movie_id, **options)
     elif algorithm == 'openai':
-        return get_openai_recommendations(conn, movie_id)
+        return await get_openai_recommendations_async(conn, movie_id, **options)
     elif algorithm == 'weighted':
-        return get_clip_and_openai_recommendations(conn, movie_id)
+        return await get_clip_and_openai_recommendations_async(conn, movie_id, **options)
     else:
         raise KeyError(f"Provided algorithm {algorithm} is not supported. Supported list of algorithms: {SUPPORTED_ALGORITHMS}")
 
 
-def get_dummy_recommendations(movie_id: int):
-    return list(range(movie_id+1, movie_id+6))
+MEMORY_INDEX_ALGORITHMS = ("clip", "openai", "weighted")
+# Options the in-memory index honours. It searches the full-dimensional embeddings exactly, so there's
+# no shortlist for `candidates` to size. Any other option (storage, mode, ef_search, ...) asks for pgvector.
+MEMORY_INDEX_OPTIONS = {"top_k", "alpha", "candidates", "dimensions"}
+# The column and the default search size of the single-embedding algorithms
+SEARCH_COLUMNS = {
+    "clip": ("clip_embedding", CLIP_SEARCH_DIMENSIONS),
+    "openai": ("openai_embedding", OPENAI_SEARCH_DIMENSIONS),
+}
+
+
+def memory_index_answers(algorithm, options=None) -> bool:
+    """
+    Whether `algorithm` with `options` is answered by the in-memory index. A reduced copy of the
+    embeddings (the `dimensions` option or *_SEARCH_DIMENSIONS) isn't kept in memory, pgvector searches it.
+    """
+    options = options or {}
+    if VECTOR_BACKEND != "memory" or algorithm not in MEMORY_INDEX_ALGORITHMS or not memory_index.ready:
+        return False
+    if not MEMORY_INDEX_OPTIONS.issuperset(options):
+        return False
+    if algorithm in SEARCH_COLUMNS:
+        column, default_dimensions = SEARCH_COLUMNS[algorithm]
+        return reduced_column(column, options.get("dimensions") or default_dimensions) == column
+    return True
+
+def _memory_search(movie_id, algorithm, top_k: int = 5, alpha: float = WEIGHTED_ALPHA,
+                   candidates: int = None, dimensions: int = None):
+    # memory_index_answers() made sure `dimensions` is the full size, and the search is exact whatever the `candidates`
+    with span("memory_index", algorithm):
+        return memory_index.search(algorithm, movie_id, top_k=top_k, alpha=alpha)
+
+
+def get_dummy_recommendations(movie_id: int, top_k: int = 5):
+    return list(range(movie_id+1, movie_id+1+top_k))
 
-def get_clip_recommendations(conn, movie_id: int, top_k: int = 5):
+
+PRECOMPUTED_NEIGHBOURS_SQL = """
+    SELECT similar_movie_id
+    FROM similar_embedding_movies
+    WHERE algorithm = %s AND movie_id = %s
+    ORDER BY rank
+    LIMIT %s;
+"""
+
+
+@timed("db")
+def get_precomputed_neighbours(conn, algorithm: str, movie_id: int, top_k: int = 5, alpha: float = WEIGHTED_ALPHA):
     """
-    Returns a list of (movie_id, cosine_distance) for the top_k nearest neighbors 
-    (by cosine distance) to the embedding of target_movie_id.
+    Reads the neighbours materialised by neighbours_processor.
+    Returns None when the movie hasn't been materialised yet, so callers can fall back to the live query.
     """
+    if top_k > NEIGHBOURS_TOP_K:
+        return None
     with conn.cursor() as cur:
-        cur.execute(
-            "SELECT clip_embedding FROM movie_embeddings_table WHERE id = %s;",
-            (movie_id,)
-        )
+        cur.execute(PRECOMPUTED_NEIGHBOURS_SQL, (neighbour_table_key(algorithm, alpha), movie_id, top_k))
+        neighbours = [row[0] for row in cur.fetchall()]
+    return neighbours or None
+
+@timed("db")
+async def get_precomputed_neighbours_async(conn, algorithm: str, movie_id: int, top_k: int = 5, alpha: float = WEIGHTED_ALPHA):
+    if top_k > NEIGHBOURS_TOP_K:
+        return None
+    async with conn.cursor() as cur:
+        await cur.execute(PRECOMPUTED_NEIGHBOURS_SQL, (neighbour_table_key(algorithm, alpha), movie_id, top_k))
+        neighbours = [row[0] for row in await cur.fetchall()]
+    return neighbours or None
+
+
+# {column} is an embedding column or one of its reduced copies, see vector_indexes.reduced_column
+EMBEDDING_SQL = "SELECT {column} FROM movie_embeddings_table WHERE id = %s;"
+NEIGHBOURS_SQL = """
+    SELECT
+        id as movie_id
+    FROM
+        movie_embeddings_table
+    WHERE
+        id <> %s
+    ORDER BY
+        {column} <=> %s ASC
+    LIMIT %s;
+"""
+
+CLIP_EMBEDDING_SQL = EMBEDDING_SQL.format(column="clip_embedding")
+CLIP_NEIGHBOURS_SQL = NEIGHBOURS_SQL.format(column="clip_embedding")
+
+OPENAI_EMBEDDING_SQL = EMBEDDING_SQL.format(column="openai_embedding")
+OPENAI_NEIGHBOURS_SQL = NEIGHBOURS_SQL.format(column="openai_embedding")
+
+WEIGHTED_EMBEDDINGS_SQL = "SELECT clip_embedding, openai_embedding FROM movie_embeddings_table WHERE id = %s;"
+WEIGHTED_NEIGHBOURS_SQL = """
+    SELECT
+        id AS movie_id
+    FROM
+        movie_embeddings_table
+    WHERE
+        id <> %(movie_id)s
+    ORDER BY
+        (clip_embedding <=> %(clip)s)*%(alpha)s
+    + (openai_embedding <=> %(openai)s)*%(beta)s ASC
+    LIMIT %(top_k)s;
+"""
+
+# Candidate generation on both HNSW indexes, then exact rerank of the union by the weighted distance
+WEIGHTED_RERANK_SQL = """
+    WITH candidates AS (
+        (SELECT id FROM movie_embeddings_table ORDER BY clip_embedding <=> %(clip)s LIMIT %(candidates)s)
+        UNION
+        (SELECT id FROM movie_embeddings_table ORDER BY openai_embedding <=> %(openai)s LIMIT %(candidates)s)
+    )
+    SELECT
+        e.id AS movie_id
+    FROM
+        movie_embeddings_table e
+        JOIN candidates c ON c.id = e.id
+    WHERE
+        e.id <> %(movie_id)s
+    ORDER BY
+        (e.clip_embedding <=> %(clip)s)*%(alpha)s
+    + (e.openai_embedding <=> %(openai)s)*%(beta)s ASC
+    LIMIT %(top_k)s;
+"""
+
+# Coarse scan of a quantised expression index, then exact rerank of the shortlist by the float32 distance
+QUANTIZED_NEIGHBOURS_SQL = """
+    SELECT
+        c.id AS movie_id
+    FROM (
+        SELECT id, {column}
+        FROM movie_embeddings_table
+        ORDER BY {coarse_distance}
+        LIMIT %(candidates)s
+    ) c
+    WHERE
+        c.id <> %(movie_id)s
+    ORDER BY
+        c.{column} <=> %(embedding)s ASC
+    LIMIT %(top_k)s;
+"""
+
+
+def _neighbours_query(column, movie_id, embedding, top_k, storage, candidates):
+    """
+    Returns (sql, params, rows the index scan must return) of a nearest neighbours query on `column`.
+    """
+    if storage == "full":
+        return NEIGHBOURS_SQL.format(column=column), (movie_id, embedding, top_k), top_k + 1
+    if storage not in VECTOR_STORAGES:
+        raise ValueError(f"Unknown vector storage {storage!r}, expected one of {VECTOR_STORAGES}")
+    operator = "<~>" if storage == "binary" else "<=>"
+    coarse_distance = (
+        f"{quantized_expression(column, storage)} {operator} {quantized_expression(column, storage, '%(embedding)s')}"
+    )
+    candidates = max(candidates or QUANTIZED_CANDIDATES[storage], top_k + 1)
+    sql = QUANTIZED_NEIGHBOURS_SQL.format(column=column, coarse_distance=coarse_distance)
+    params = {"movie_id": movie_id, "embedding": embedding, "top_k": top_k, "candidates": candidates}
+    return sql, params, candidates
+
+
+RATING_NEIGHBOURS_SQL = """
+    SELECT
+        similar_movie_id as id
+    FROM similar_rating_movies
+    where movie_id = %s
+    ORDER BY similarity DESC
+    LIMIT %s;
+"""
+
+
+def get_clip_recommendations(conn, movie_id: int, top_k: int = 5, ef_search: int = None,
+                             storage: str = VECTOR_STORAGE, candidates: int = None, precomputed: bool = True,
+                             dimensions: int = None):
+    """
+    Returns a list of movie ids of the top_k nearest neighbors 
+    (by cosine distance) to the CLIP embedding of movie_id.
+    With a quantised `storage` ("halfvec" or "binary") the index shortlists `candidates` movies
+    on the compact codes and the float32 distance ranks them. `dimensions` searches one of the
+    reduced copies of the embeddings instead (128 or 256 for CLIP, 256 or 512 for OpenAI).
+    """
+    # The materialised neighbours are full-dimensional, a reduced size (explicit or CLIP_SEARCH_DIMENSIONS)
+    # is always searched live
+    column = reduced_column("clip_embedding", dimensions or CLIP_SEARCH_DIMENSIONS)
+    if precomputed and column == "clip_embedding":
+        neighbours = get_precomputed_neighbours(conn, "clip", movie_id, top_k)
+        if neighbours is not None:
+            return neighbours
+
+    with conn.cursor() as cur, span("db", "clip_neighbours"):
+        cur.execute(EMBEDDING_SQL.format(column=column), (movie_id,))
         row = cur.fetchone()
-        if row is None:
-            raise ValueError(f"No embedding found for id={movie_id}")
+        if row is None or row[0] is None:
+            raise ValueError(f"No {column} found for id={movie_id}")
         target_embedding = row[0]
-        
-        sql = """
-            SELECT
-                id as movie_id
-            FROM
-                movie_embeddings_table
-            WHERE
-                id <> %s
-            ORDER BY
-                clip_embedding <=> %s ASC
-            LIMIT %s;
-        """
-        cur.execute(sql, (movie_id, target_embedding, top_k))
+
+        sql, params, scan_size = _neighbours_query(
+            column, movie_id, target_embedding, top_k, storage, candidates
+        )
+        cur.execute(SET_EF_SEARCH_SQL, (ef_search_for(scan_size, ef_search),))
+        cur.execute(sql, params)
         return [row[0] for row in cur.fetchall()]
+
+async def get_clip_recommendations_async(conn, movie_id: int, top_k: int = 5, ef_search: int = None,
+                                         storage: str = VECTOR_STORAGE, candidates: int = None, precomputed: bool = True,
+                                         dimensions: int = None):
+    column = reduced_column("clip_embedding", dimensions or CLIP_SEARCH_DIMENSIONS)
+    if precomputed and column == "clip_embedding":
+        neighbours = await get_precomputed_neighbours_async(conn, "clip", movie_id, top_k)
+        if neighbours is not None:
+            return neighbours
+
+    async with conn.cursor() as cur, span("db", "clip_neighbours"):
+        await cur.execute(EMBEDDING_SQL.format(column=column), (movie_id,))
+        row = await cur.fetchone()
+        if row is None or row[0] is None:
+            raise ValueError(f"No {column} found for id={movie_id}")
+        target_embedding = row[0]
+
+        sql, params, scan_size = _neighbours_query(
+            column, movie_id, target_embedding, top_k, storage, candidates
+        )
+        await cur.execute(SET_EF_SEARCH_SQL, (ef_search_for(scan_size, ef_search),))
+        await cur.execute(sql, params)
+        return [row[0] for row in await cur.fetchall()]
     
-def get_openai_recommendations(conn, movie_id: int, top_k: int = 5):
+def get_openai_recommendations(conn, movie_id: int, top_k: int = 5, ef_search: int = None,
+                               storage: str = VECTOR_STORAGE, candidates: int = None, precomputed: bool = True,
+                               dimensions: int = None):
     """
-    Returns a list of (movie_id, cosine_distance) for the top_k nearest neighbors 
-    (by cosine distance) to the embedding of target_movie_id.
+    Returns a list of movie ids of the top_k nearest neighbors 
+    (by cosine distance) to the OpenAI description embedding of movie_id.
     """
-    with conn.cursor() as cur:
-        cur.execute(
-            "SELECT openai_embedding FROM movie_embeddings_table WHERE id = %s;",
-            (movie_id,)
-        )
+    column = reduced_column("openai_embedding", dimensions or OPENAI_SEARCH_DIMENSIONS)
+    if precomputed and column == "openai_embedding":
+        neighbours = get_precomputed_neighbours(conn, "openai", movie_id, top_k)
+        if neighbours is not None:
+            return neighbours
+
+    with conn.cursor() as cur, span("db", "openai_neighbours"):
+        cur.execute(EMBEDDING_SQL.format(column=column), (movie_id,))
         row = cur.fetchone()
-        if row is None:
-            raise ValueError(f"No embedding found for id={movie_id}")
+        if row is None or row[0] is None:
+            raise ValueError(f"No {column} found for id={movie_id}")
         target_embedding = row[0]
-        
-        sql = """
-            SELECT
-                id as movie_id
-            FROM
-                movie_embeddings_table
-            WHERE
-                id <> %s
-            ORDER BY
-                openai_embedding <=> %s ASC
-            LIMIT %s;
-        """
-        cur.execute(sql, (movie_id, target_embedding, top_k))
+
+        sql, params, scan_size = _neighbours_query(
+            column, movie_id, target_embedding, top_k, storage, candidates
+        )
+        cur.execute(SET_EF_SEARCH_SQL, (ef_search_for(scan_size, ef_search),))
+        cur.execute(sql, params)
         return [row[0] for row in cur.fetchall()]
-    
-def get_clip_and_openai_recommendations(conn, movie_id: int, alpha=0.3, top_k: int = 5):
-    with conn.cursor() as cur:
-        cur.execute(
-            "SELECT clip_embedding, openai_embedding FROM movie_embeddings_table WHERE id = %s;",
-            (movie_id,)
+
+async def get_openai_recommendations_async(conn, movie_id: int, top_k: int = 5, ef_search: int = None,
+                                           storage: str = VECTOR_STORAGE, candidates: int = None, precomputed: bool = True,
+                                           dimensions: int = None):
+    column = reduced_column("openai_embedding", dimensions or OPENAI_SEARCH_DIMENSIONS)
+    if precomputed and column == "openai_embedding":
+        neighbours = await get_precomputed_neighbours_async(conn, "openai", movie_id, top_k)
+        if neighbours is not None:
+            return neighbours
+
+    async with conn.cursor() as cur, span("db", "openai_neighbours"):
+        await cur.execute(EMBEDDING_SQL.format(column=column), (movie_id,))
+        row = await cur.fetchone()
+        if row is None or row[0] is None:
+            raise ValueError(f"No {column} found for id={movie_id}")
+        target_embedding = row[0]
+
+        sql, params, scan_size = _neighbours_query(
+            column, movie_id, target_embedding, top_k, storage, candidates
         )
+        await cur.execute(SET_EF_SEARCH_SQL, (ef_search_for(scan_size, ef_search),))
+        await cur.execute(sql, params)
+        return [row[0] for row in await cur.fetchall()]
+    
+def get_clip_and_openai_recommendations(conn, movie_id: int, alpha=WEIGHTED_ALPHA, top_k: int = 5,
+                                        candidates: int = WEIGHTED_CANDIDATES, mode: str = WEIGHTED_SEARCH_MODE,
+                                        precomputed: bool = True, ef_search: int = None):
+    """
+    Returns the top_k movies by alpha * clip cosine distance + (1 - alpha) * openai cosine distance.
+    Served from the materialised neighbours when available, otherwise by the live query in `mode`
+    ("rerank" over `candidates` HNSW hits per embedding, or "exact" over the whole table).
+    """
+    candidates = max(candidates, top_k + 1)
+    if precomputed:
+        neighbours = get_precomputed_neighbours(conn, "weighted", movie_id, top_k, alpha=alpha)
+        if neighbours is not None:
+            return neighbours
+
+    with conn.cursor() as cur, span("db", "weighted_neighbours"):
+        cur.execute(WEIGHTED_EMBEDDINGS_SQL, (movie_id,))
         row = cur.fetchone()
         if row is None:
             raise ValueError(f"No embedding found for id={movie_id}")
         clip_embedding, openai_embedding = row
-        
-        beta = 1.0 - alpha
-
-        sql = """
-            SELECT
-                id AS movie_id
-            FROM
-                movie_embeddings_table
-            WHERE
-                id <> %s
-            ORDER BY
-                (clip_embedding <=> %s)*%s
-            + (openai_embedding <=> %s)*%s ASC
-            LIMIT %s;
-        """
-        cur.execute(
-            sql,
-            (
-                movie_id,
-                clip_embedding,
-                alpha,
-                openai_embedding,
-                beta,
-                top_k,
-            ),
-        )
+
+        sql, params = _weighted_query(movie_id, clip_embedding, openai_embedding, alpha, top_k, candidates, mode)
+        if mode == "rerank":
+            cur.execute(SET_EF_SEARCH_SQL, (ef_search_for(candidates, ef_search),))
+        cur.execute(sql, params)
         return [row[0] for row in cur.fetchall()]
+
+async def get_clip_and_openai_recommendations_async(conn, movie_id: int, alpha=WEIGHTED_ALPHA, top_k: int = 5,
+                                                    candidates: int = WEIGHTED_CANDIDATES, mode: str = WEIGHTED_SEARCH_MODE,
+                                                    precomputed: bool = True, ef_search: int = None):
+    candidates = max(candidates, top_k + 1)
+    if precomputed:
+        neighbours = await get_precomputed_neighbours_async(conn, "weighted", movie_id, top_k, alpha=alpha)
+        if neighbours is not None:
+            return neighbours
+
+    async with conn.cursor() as cur, span("db", "weighted_neighbours"):
+        await cur.execute(WEIGHTED_EMBEDDINGS_SQL, (movie_id,))
+        row = await cur.fetchone()
+        if row is None:
+            raise ValueError(f"No embedding found for id={movie_id}")
+        clip_embedding, openai_embedding = row
+
+        sql, params = _weighted_query(movie_id, clip_embedding, openai_embedding, alpha, top_k, candidates, mode)
+        if mode == "rerank":
+            await cur.execute(SET_EF_SEARCH_SQL, (ef_search_for(candidates, ef_search),))
+        await cur.execute(sql, params)
+        return [row[0] for row in await cur.fetchall()]
+
+def _weighted_query(movie_id, clip_embedding, openai_embedding, alpha, top_k, candidates, mode):
+    if mode not in ("rerank", "exact"):
+        raise ValueError(f"Unknown weighted search mode {mode!r}, expected 'rerank' or 'exact'")
+    params = {
+        "movie_id": movie_id,
+        "clip": clip_embedding,
+        "openai": openai_embedding,
+        "alpha": alpha,
+        "beta": 1.0 - alpha,
+        "top_k": top_k,
+        "candidates": candidates,
+    }
+    return (WEIGHTED_RERANK_SQL if mode == "rerank" else WEIGHTED_NEIGHBOURS_SQL), params
     
 def get_rating_item2item_recommendation(conn, movie_id: int, top_k: int = 5):
-    with conn.cursor() as cur:
-        sql = """SELECT
-                    similar_movie_id as id
-                FROM similar_rating_movies
-                where movie_id = %s
-                LIMIT %s;
-        """
-        cur.execute(sql, (movie_id, top_k))
+    with conn.cursor() as cur, span("db", "rating_neighbours"):
+        cur.execute(RATING_NEIGHBOURS_SQL, (movie_id, top_k))
         return [row[0] for row in cur.fetchall()]
 
-def get_chatgpt_recommendations(conn, movie_id: int):
+async def get_rating_item2item_recommendation_async(conn, movie_id: int, top_k: int = 5):
+    async with conn.cursor() as cur, span("db", "rating_neighbours"):
+        await cur.execute(RATING_NEIGHBOURS_SQL, (movie_id, top_k))
+        return [row[0] for row in await cur.fetchall()]
+
+def get_chatgpt_recommendations(conn, movie_id: int, top_k: int = 5):
+    """
+    Served from llm_recommendations. On a miss the LLM is asked right away and its answer is cached.
+    """
+    cached = get_cached_recommendations(conn, movie_id)
+    if cached is not None:
+        return cached[:top_k]
+
     metadata = get_movie_metadata(conn, movie_id)
-    movie_title = metadata['title']
+    recommended_titles = get_chatgpt_predictions(metadata['title'])
+    recommended_ids = resolve_titles(conn, recommended_titles, exclude_movie_id=movie_id)
+    with atomic(conn), conn.cursor() as cur:
+        store_recommendations(cur, movie_id, recommended_titles, recommended_ids)
+    return recommended_ids[:top_k]
 
-    recommended_titles = get_chatgpt_predictions(movie_title)
-    recommended_ids = []
-    for title in recommended_titles:
-        try:
-            search_results = search_movies_by_title(conn, title, threshold=0.6)
-            if len(search_results) > 0:
-                recommended_ids.append(search_results[0])
-        finally:
-            continue
-    return recommended_ids[:5]
\ No newline at end of file
+async def get_chatgpt_recommendations_async(conn, movie_id: int, top_k: int = 5, db_pool=None):
+    """
+    Served from llm_recommendations. On a miss with a `db_pool` the LLM is asked in a background task,
+    which stores the answer for the next view, and RecommendationPending is raised right away.
+    Without a pool the LLM is asked inline.
+    """
+    cached = await get_cached_recommendations_async(conn, movie_id)
+    if cached is not None:
+        return cached[:top_k]
+
+    metadata = await get_movie_metadata_async(conn, movie_id)
+    if db_pool is None:
+        recommended_ids = await _ask_chatgpt_async(conn, movie_id, metadata['title'])
+        return recommended_ids[:top_k]
+
+    if movie_id not in _chatgpt_refreshes:
+        task = asyncio.create_task(_refresh_chatgpt_cache_async(db_pool, movie_id, metadata['title']))
+        _chatgpt_refreshes[movie_id] = task
+        task.add_done_callback(lambda task: _chatgpt_refreshes.pop(movie_id, None))
+        task.add_done_callback(_discard_background_task)
+    raise RecommendationPending(f"ChatGPT recommendations for movie {movie_id} are being computed")
+
+_chatgpt_refreshes = {}
+
+async def _refresh_chatgpt_cache_async(db_pool, movie_id, title):
+    # No connection is held while waiting for the LLM
+    recommended_titles = await get_chatgpt_predictions_async(title)
+    async with db_pool.connection() as conn:
+        await _store_chatgpt_answer_async(conn, movie_id, recommended_titles)
+
+async def _ask_chatgpt_async(conn, movie_id, title):
+    recommended_titles = await get_chatgpt_predictions_async(title)
+    return await _store_chatgpt_answer_async(conn, movie_id, recommended_titles)
+
+async def _store_chatgpt_answer_async(conn, movie_id, recommended_titles):
+    recommended_ids = await resolve_titles_async(conn, recommended_titles, exclude_movie_id=movie_id)
+    async with conn.transaction():
+        async with conn.cursor() as cur:
+            await store_recommendations_async(cur, movie_id, recommended_titles, recommended_ids)
+    return recommended_ids
@@ -0,0 +1,177 @@
+import asyncio
+import json
+import os
+import time
+
+from cache import TTLCache, MISSING
+
+# "memory" keeps responses in this process, "redis" shares them between workers, "off" disables caching
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "2000"))
+# Seconds a response is served as fresh, then as stale while it's recomputed in the background
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "600"))
+RESPONSE_CACHE_STALE_TTL = float(os.getenv("RESPONSE_CACHE_STALE_TTL", "3600"))
+# Responses with missing parts (an algorithm failed or timed out) are only kept briefly
+RESPONSE_CACHE_INCOMPLETE_TTL = float(os.getenv("RESPONSE_CACHE_INCOMPLETE_TTL", "30"))
+# Seconds between checks whether a preprocessing job changed the data
+DATA_VERSION_POLL_INTERVAL = float(os.getenv("DATA_VERSION_POLL_INTERVAL", "10"))
+
+
+class MemoryBackend:
+    """
+    Entries live in an in-process LRU, every worker process has its own.
+    """
+
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE):
+        self._cache = TTLCache(maxsize=maxsize)
+
+    async def get(self, key):
+        entry = self._cache.get(key)
+        return None if entry is MISSING else entry
+
+    async def set(self, key, entry, ttl):
+        self._cache.set(key, entry, ttl=ttl)
+
+    async def close(self):
+        self._cache.clear()
+
+
+class RedisBackend:
+    """
+    Entries are stored as JSON in a Redis-compatible server, shared by all worker processes.
+    """
+
+    def __init__(self, url: str = REDIS_URL, prefix: str = "movielens:response:"):
+        try:
+            # Optional dependency, only needed with RESPONSE_CACHE_BACKEND=redis
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise ImportError("RESPONSE_CACHE_BACKEND=redis needs the redis package: pip install redis") from e
+
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    async def get(self, key):
+        raw = await self._client.get(self._prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key, entry, ttl):
+        await self._client.set(self._prefix + key, json.dumps(entry, default=str), ex=max(1, int(ttl)))
+
+    async def close(self):
+        await self._client.aclose()
+
+
+def create_backend(name: str = RESPONSE_CACHE_BACKEND):
+    if name == "off":
+        return None
+    if name == "memory":
+        return MemoryBackend()
+    if name == "redis":
+        return RedisBackend()
+    raise ValueError(f"Unknown response cache backend: {name}")
+
+
+class ResponseCache:
+    """
+    Caches computed responses with stale-while-revalidate.
+
+    A fresh entry is returned as is. A stale entry is returned too, and a background task recomputes it.
+    Concurrent misses for the same key share one computation. Keys include the data version,
+    so every entry is invalidated when a preprocessing job bumps data_versions.
+    """
+
+    def __init__(self, backend, ttl: float = RESPONSE_CACHE_TTL, stale_ttl: float = RESPONSE_CACHE_STALE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.data_version = ""
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self._in_flight = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    def key(self, *parts) -> str:
+        return ":".join(str(part) for part in parts) + f"@{self.data_version}"
+
+    def set_data_versions(self, versions: dict) -> bool:
+        """
+        Switches to new keys when any dataset changed. Returns whether it did.
+        """
+        data_version = ",".join(f"{name}={version}" for name, version in sorted(versions.items()))
+        changed = data_version != self.data_version
+        self.data_version = data_version
+        return changed
+
+    async def get_or_compute(self, key, compute, is_complete=lambda value: True):
+        """
+        Returns the cached value for `key`, computing it with `await compute()` on a miss.
+        Values for which is_complete(value) is false are kept for RESPONSE_CACHE_INCOMPLETE_TTL only.
+        """
+        if not self.enabled:
+            return await compute()
+
+        entry = await self.backend.get(key)
+        if entry is not None:
+            age = time.time() - entry["created_at"]
+            if age < entry["ttl"]:
+                self.hits += 1
+                return entry["value"]
+            self.stale_hits += 1
+            if key not in self._in_flight:
+                self.refreshes += 1
+                task = self._start(key, compute, is_complete)
+                task.add_done_callback(self._log_refresh_error)
+            return entry["value"]
+
+        self.misses += 1
+        task = self._in_flight.get(key) or self._start(key, compute, is_complete)
+        return await asyncio.shield(task)
+
+    def _start(self, key, compute, is_complete):
+        task = asyncio.ensure_future(self._compute_and_store(key, compute, is_complete))
+        self._in_flight[key] = task
+        task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return task
+
+    async def _compute_and_store(self, key, compute, is_complete):
+        value = await compute()
+        ttl = self.ttl if is_complete(value) else min(self.ttl, RESPONSE_CACHE_INCOMPLETE_TTL)
+        entry = {"value": value, "created_at": time.time(), "ttl": ttl}
+        # The entry outlives its freshness so it can be served stale while it's recomputed
+        await self.backend.set(key, entry, ttl + self.stale_ttl)
+        return value
+
+    def _log_refresh_error(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            self.refresh_errors += 1
+            print(f"Couldn't refresh a cached response: {task.exception()}")
+
+    async def close(self):
+        for task in list(self._in_flight.values()):
+            task.cancel()
+        if self.backend is not None:
+            await self.backend.close()
+
+    def stats(self) -> dict:
+        total = self.hits + self.stale_hits + self.misses
+        return {
+            "backend": type(self.backend).__name__ if self.backend else None,
+            "data_version": self.data_version,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.stale_hits) / total if total else 0.0,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+        }
+
+
+response_cache = ResponseCache(create_backend())
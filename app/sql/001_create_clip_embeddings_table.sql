@@ -4,10 +4,6 @@ CREATE TABLE IF NOT EXISTS movie_embeddings_table (
     openai_embedding VECTOR(1536)
 );
 
-CREATE INDEX IF NOT EXISTS idx_movie_embeddings_cosine_hnsw
-  ON movie_embeddings_table
-  USING hnsw (clip_embedding vector_cosine_ops);
-
-CREATE INDEX IF NOT EXISTS idx_movie_embeddings_cosine_hnsw
-  ON movie_embeddings_table
-  USING hnsw (openai_embedding vector_cosine_ops);
\ No newline at end of file
+-- The HNSW indexes are managed by vector_indexes.py and built after the embeddings are loaded.
+-- Older databases have the clip index under a name that was shared with the (never created) openai one.
+ALTER INDEX IF EXISTS idx_movie_embeddings_cosine_hnsw RENAME TO idx_movie_embeddings_clip_cosine_hnsw;
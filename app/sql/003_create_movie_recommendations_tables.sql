@@ -3,3 +3,6 @@ CREATE TABLE IF NOT EXISTS similar_rating_movies (
     similar_movie_id INTEGER      NOT NULL,
     similarity FLOAT NOT NULL
 );
+
+CREATE INDEX IF NOT EXISTS idx_similar_rating_movies_movie_id
+    ON similar_rating_movies (movie_id, similarity DESC);
@@ -0,0 +1,10 @@
+-- Top-K neighbours precomputed by neighbours_processor.py for the embedding-based algorithms.
+-- algorithm is 'clip', 'openai' or 'weighted:<alpha>'.
+CREATE TABLE IF NOT EXISTS similar_embedding_movies (
+    algorithm        TEXT     NOT NULL,
+    movie_id         INTEGER  NOT NULL,
+    rank             SMALLINT NOT NULL,
+    similar_movie_id INTEGER  NOT NULL,
+    distance         REAL     NOT NULL,
+    PRIMARY KEY (algorithm, movie_id, rank)
+);
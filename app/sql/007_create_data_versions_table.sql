@@ -0,0 +1,6 @@
+-- Bumped by the preprocessing jobs whenever a dataset changes, so the API can reload what it keeps in memory.
+CREATE TABLE IF NOT EXISTS data_versions (
+  name       TEXT      PRIMARY KEY,
+  version    BIGINT    NOT NULL DEFAULT 0,
+  updated_at TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW()
+);
@@ -0,0 +1,16 @@
+-- Per-movie checkpoints of the embedding stages: what the stored embedding was computed from.
+CREATE TABLE IF NOT EXISTS embedding_status (
+  stage         TEXT      NOT NULL,
+  movie_id      INT       NOT NULL,
+  input_hash    TEXT      NOT NULL,
+  model_version TEXT      NOT NULL,
+  updated_at    TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW(),
+  PRIMARY KEY (stage, movie_id)
+);
+
+-- Checkpoints of the whole-table stages (CSV loads, rating similarities).
+CREATE TABLE IF NOT EXISTS preprocess_checkpoints (
+  stage        TEXT      PRIMARY KEY,
+  input_hash   TEXT      NOT NULL,
+  completed_at TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW()
+);
@@ -0,0 +1,2 @@
+-- TMDB's vote_average goes up to 10.0, which overflows NUMERIC(4,3).
+ALTER TABLE movies_metadata ALTER COLUMN avg_rating TYPE NUMERIC(5,3);
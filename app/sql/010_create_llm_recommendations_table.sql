@@ -0,0 +1,10 @@
+-- Movies recommended by an LLM, resolved to movie ids. Filled on demand and by llm_cache.py warmup.
+CREATE TABLE IF NOT EXISTS llm_recommendations (
+  movie_id        INT       NOT NULL,
+  model           TEXT      NOT NULL,
+  prompt_version  TEXT      NOT NULL,
+  titles          TEXT[]    NOT NULL,
+  recommended_ids INT[]     NOT NULL,
+  created_at      TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW(),
+  PRIMARY KEY (movie_id, model, prompt_version)
+);
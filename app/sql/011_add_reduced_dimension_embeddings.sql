@@ -0,0 +1,19 @@
+-- Reduced copies of the embeddings, filled by dimension_reduction.py (see REDUCED_DIMENSIONS in vector_indexes.py).
+-- The upsert of an embedding resets its copies to NULL, so they are recomputed from the new vector.
+ALTER TABLE movie_embeddings_table
+  ADD COLUMN IF NOT EXISTS clip_embedding_128   VECTOR(128),
+  ADD COLUMN IF NOT EXISTS clip_embedding_256   VECTOR(256),
+  ADD COLUMN IF NOT EXISTS openai_embedding_256 VECTOR(256),
+  ADD COLUMN IF NOT EXISTS openai_embedding_512 VECTOR(512);
+
+-- PCA projections of the CLIP embeddings: x -> normalize((x - mean) @ components^T).
+-- components is the row-major dimensions x source_dimensions matrix.
+CREATE TABLE IF NOT EXISTS embedding_projections (
+  target_column      TEXT      PRIMARY KEY,
+  source_column      TEXT      NOT NULL,
+  dimensions         INT       NOT NULL,
+  mean               REAL[]    NOT NULL,
+  components         REAL[]    NOT NULL,
+  explained_variance REAL,
+  fitted_at          TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW()
+);
@@ -0,0 +1,93 @@
+import asyncio
+
+import llm_cache
+from llm_cache import (
+    get_cached_recommendations, get_cached_recommendations_async, resolve_titles, store_recommendations,
+)
+from openai_processor import CHATGPT_MODEL, CHATGPT_PROMPT_VERSION
+from title_index import TitleIndex
+
+
+class FakeCursor:
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class FakeAsyncCursor(FakeCursor):
+    async def execute(self, sql, params=None):
+        super().execute(sql, params)
+
+    async def fetchone(self):
+        return super().fetchone()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def cursor(self):
+        return self._cursor
+
+
+def test_cached_recommendations_are_keyed_by_movie_model_and_prompt_version():
+    cursor = FakeCursor([([3, 1, 2],)])
+    assert get_cached_recommendations(FakeConnection(cursor), 42) == [3, 1, 2]
+    assert cursor.executed[0][1] == (42, CHATGPT_MODEL, CHATGPT_PROMPT_VERSION)
+
+    cursor = FakeCursor()
+    assert get_cached_recommendations(FakeConnection(cursor), 42, model="other", prompt_version=99) is None
+    assert cursor.executed[0][1] == (42, "other", 99)
+
+
+def test_cached_recommendations_async_miss():
+    cursor = FakeAsyncCursor()
+    assert asyncio.run(get_cached_recommendations_async(FakeConnection(cursor), 7)) is None
+    assert cursor.executed[0][1] == (7, CHATGPT_MODEL, CHATGPT_PROMPT_VERSION)
+
+
+def test_store_recommendations_upserts_the_titles_and_ids():
+    cursor = FakeCursor()
+    store_recommendations(cursor, 42, ("Heat", "Ronin"), (6, 2000))
+    sql, params = cursor.executed[0]
+    assert "ON CONFLICT (movie_id, model, prompt_version)" in sql
+    assert params == (42, CHATGPT_MODEL, CHATGPT_PROMPT_VERSION, ["Heat", "Ronin"], [6, 2000])
+
+
+def test_resolve_titles_keeps_the_order_and_drops_duplicates_and_the_source_movie(monkeypatch):
+    index = TitleIndex()
+    index.build([(1, "Heat (1995)"), (2, "Ronin (1998)"), (3, "Collateral (2004)")])
+    monkeypatch.setattr(llm_cache, "title_index", index)
+    titles = ["Collateral", "Heat", "Ronin", "Collateral (2004)", "Completely Unknown Film"]
+    assert resolve_titles(None, titles, exclude_movie_id=1) == [3, 2]
+
+
+def test_resolve_titles_asks_postgres_without_the_title_index(monkeypatch):
+    calls = []
+
+    def resolve_movie_titles(conn, titles, threshold):
+        calls.append((conn, list(titles), threshold))
+        return [(0, 5, 0.9), (1, 5, 0.8), (2, 9, 0.7)]
+
+    monkeypatch.setattr(llm_cache, "title_index", TitleIndex())
+    monkeypatch.setattr(llm_cache, "resolve_movie_titles", resolve_movie_titles)
+    assert resolve_titles("conn", ["A", "A again", "B"], exclude_movie_id=1) == [5, 9]
+    assert calls == [("conn", ["A", "A again", "B"], llm_cache.TITLE_MATCH_THRESHOLD)]
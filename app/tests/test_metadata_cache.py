@@ -0,0 +1,13 @@
+from metadata_cache import MovieMetadataCache, NOT_FOUND
+
+
+def test_a_new_metadata_version_drops_the_memory_layer():
+    cache = MovieMetadataCache()
+    assert cache.set_data_version(1)
+    cache.memory.set(1, {"title": "Heat"})
+    cache.memory.set(2, NOT_FOUND, ttl=300)
+    assert not cache.set_data_version(1)
+    assert len(cache.memory) == 2
+    assert cache.set_data_version(2)
+    assert len(cache.memory) == 0
+    assert cache.stats()["data_version"] == 2
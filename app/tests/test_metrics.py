@@ -0,0 +1,92 @@
+import asyncio
+
+import metrics
+from metrics import Histogram, render_stats, server_timing_header, span, timed
+
+
+def test_histogram_renders_cumulative_buckets_per_series():
+    histogram = Histogram("test_seconds", "Test latency.", ("route",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, "/b")
+    histogram.observe(0.5, "/a")
+    histogram.observe(0.1, "/a")
+    histogram.observe(5.0, "/a")
+    assert histogram.render() == [
+        "# HELP test_seconds Test latency.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{route="/a",le="0.1"} 1',
+        'test_seconds_bucket{route="/a",le="1.0"} 2',
+        'test_seconds_bucket{route="/a",le="+Inf"} 3',
+        'test_seconds_sum{route="/a"} 5.6',
+        'test_seconds_count{route="/a"} 3',
+        'test_seconds_bucket{route="/b",le="0.1"} 1',
+        'test_seconds_bucket{route="/b",le="1.0"} 1',
+        'test_seconds_bucket{route="/b",le="+Inf"} 1',
+        'test_seconds_sum{route="/b"} 0.05',
+        'test_seconds_count{route="/b"} 1',
+    ]
+
+
+def test_histogram_without_labels_and_escaping():
+    histogram = Histogram("plain_seconds", "Plain.", buckets=(1.0,))
+    histogram.observe(2.0)
+    assert histogram.render()[2:] == [
+        'plain_seconds_bucket{le="1.0"} 0',
+        'plain_seconds_bucket{le="+Inf"} 1',
+        "plain_seconds_sum 2.0",
+        "plain_seconds_count 1",
+    ]
+    labelled = Histogram("quoted_seconds", "Quoted.", ("name",), buckets=())
+    labelled.observe(1.0, 'say "hi"\n')
+    assert labelled.render()[2] == 'quoted_seconds_bucket{name="say \\"hi\\"\\n",le="+Inf"} 1'
+
+
+def test_server_timing_header_sorts_by_duration_and_counts_calls():
+    timings = {"db.ratings": [0.002, 1], "tmdb.movie": [0.0305, 3]}
+    assert server_timing_header(timings, 0.05) == (
+        'tmdb.movie;dur=30.5;desc="3 calls", db.ratings;dur=2.0, total;dur=50.0'
+    )
+    assert server_timing_header({}, 0.001) == "total;dur=1.0"
+
+
+def test_render_stats_with_and_without_a_label():
+    assert render_stats("movielens_index", {"ready": True, "rows": 3, "source": "snapshot"}) == [
+        "# TYPE movielens_index_ready gauge",
+        "movielens_index_ready 1",
+        "# TYPE movielens_index_rows gauge",
+        "movielens_index_rows 3",
+    ]
+    stats = {"tmdb": {"hits": 5, "hit_rate": 0.5}, "metadata": {"hits": 2, "backend": "memory"}}
+    assert render_stats("movielens_cache", stats, "cache") == [
+        "# TYPE movielens_cache_hits gauge",
+        'movielens_cache_hits{cache="tmdb"} 5',
+        'movielens_cache_hits{cache="metadata"} 2',
+        "# TYPE movielens_cache_hit_rate gauge",
+        'movielens_cache_hit_rate{cache="tmdb"} 0.5',
+    ]
+
+
+def test_spans_add_up_in_the_current_request():
+    @timed("db")
+    async def ratings_async():
+        await asyncio.sleep(0)
+
+    async def request():
+        timings = {}
+        token = metrics._request_timings.set(timings)
+        try:
+            with span("render", "movie.html"):
+                pass
+            await asyncio.gather(ratings_async(), ratings_async())
+        finally:
+            metrics._request_timings.reset(token)
+        return timings
+
+    timings = asyncio.run(request())
+    assert set(timings) == {"render.movie.html", "db.ratings"}
+    assert timings["db.ratings"][1] == 2
+
+
+def test_render_ends_with_a_newline_and_appends_the_extra_lines():
+    text = metrics.render(["# TYPE extra gauge", "extra 1"])
+    assert text.endswith("extra 1\n")
+    assert "# TYPE movielens_http_request_seconds histogram" in text
@@ -0,0 +1,42 @@
+import pytest
+
+import preprocess
+from memory_index import EMBEDDINGS_DATA_VERSION
+
+
+class FakeConnection:
+    autocommit = False
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    calls = []
+    monkeypatch.setattr(preprocess, "preprocess_clip_embeddings", lambda cur, limit, force: calls.append("clip") or 3)
+    monkeypatch.setattr(preprocess, "preprocess_openai_embeddings", lambda cur, limit, force: calls.append("openai") or 0)
+    monkeypatch.setattr(preprocess, "compute_and_store_embedding_neighbours", lambda conn: calls.append("neighbours"))
+    monkeypatch.setattr(preprocess, "bump_data_version", lambda cur, name: calls.append(f"bump {name}"))
+    return calls
+
+
+def test_a_single_embedding_stage_recomputes_the_neighbours_and_bumps_the_version(pipeline):
+    preprocess.run_stages(FakeConnection(), ["clip"])
+    assert pipeline == ["clip", "neighbours", f"bump {EMBEDDINGS_DATA_VERSION}"]
+
+
+def test_unchanged_embeddings_keep_the_neighbours_and_version(pipeline):
+    preprocess.run_stages(FakeConnection(), ["openai"])
+    assert pipeline == ["openai"]
+
+
+def test_the_neighbours_stage_runs_once(pipeline):
+    preprocess.run_stages(FakeConnection(), ["clip", "neighbours"])
+    assert pipeline == ["clip", "neighbours", f"bump {EMBEDDINGS_DATA_VERSION}"]
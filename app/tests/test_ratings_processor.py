@@ -0,0 +1,41 @@
+import numpy as np
+
+from ratings_processor import store_similar_movies_in_pg
+
+
+class FakeConnection:
+    autocommit = False
+
+    def __init__(self):
+        self.copied = None
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, sql):
+        pass
+
+    def copy_expert(self, sql, buffer):
+        self.copied = buffer.read()
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def test_only_positive_similarities_are_stored():
+    movie_ids = np.array([10, 20, 30])
+    neighbour_indices = np.array([[1, 2], [0, 2], [0, 1]])
+    # Movie 30 has no co-raters: its "neighbours" are arbitrary movies at similarity 0
+    similarities = np.array([[0.9, -0.2], [0.9, 0.0], [0.0, 0.0]], dtype=np.float32)
+    conn = FakeConnection()
+    store_similar_movies_in_pg(conn, movie_ids, neighbour_indices, similarities)
+    assert conn.copied == "10\t20\t0.900000\n20\t10\t0.900000\n"
@@ -0,0 +1,34 @@
+import pytest
+
+import recommendations
+from recommendations import memory_index_answers
+
+
+@pytest.fixture
+def memory_backend(monkeypatch):
+    monkeypatch.setattr(recommendations, "VECTOR_BACKEND", "memory")
+    monkeypatch.setattr(recommendations.memory_index, "_snapshot", object())
+    monkeypatch.setattr(recommendations, "SEARCH_COLUMNS", {
+        "clip": ("clip_embedding", None),
+        "openai": ("openai_embedding", 512),
+    })
+
+
+def test_the_memory_index_answers_full_dimensional_searches(memory_backend):
+    assert memory_index_answers("clip")
+    assert memory_index_answers("clip", {"dimensions": 512, "top_k": 10})
+    assert memory_index_answers("weighted", {"alpha": 0.5, "candidates": 50})
+    assert memory_index_answers("openai", {"dimensions": 1536})
+
+
+def test_reduced_copies_and_pgvector_options_are_searched_in_postgres(memory_backend):
+    assert not memory_index_answers("clip", {"dimensions": 128})
+    # OPENAI_SEARCH_DIMENSIONS picks the 512-dimensional copy by default
+    assert not memory_index_answers("openai")
+    assert not memory_index_answers("weighted", {"mode": "rerank"})
+    assert not memory_index_answers("ratings")
+
+
+def test_the_pgvector_backend_never_uses_the_memory_index(monkeypatch):
+    monkeypatch.setattr(recommendations, "VECTOR_BACKEND", "pgvector")
+    assert not memory_index_answers("clip")
@@ -0,0 +1,93 @@
+import asyncio
+
+from response_cache import MemoryBackend, ResponseCache, RESPONSE_CACHE_INCOMPLETE_TTL
+
+
+class Counter:
+    def __init__(self, values=None):
+        self.calls = 0
+        self.values = values
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(0)
+        return self.values[self.calls - 1] if self.values else self.calls
+
+
+def _age(cache, key, seconds):
+    entry = cache.backend._cache.get(key)
+    entry["created_at"] -= seconds
+
+
+def test_fresh_entry_is_served_from_the_cache():
+    async def scenario():
+        cache = ResponseCache(MemoryBackend(), ttl=60, stale_ttl=60)
+        compute = Counter()
+        first = await cache.get_or_compute("movie:1", compute)
+        second = await cache.get_or_compute("movie:1", compute)
+        return first, second, compute.calls, cache.stats()
+
+    first, second, calls, stats = asyncio.run(scenario())
+    assert (first, second, calls) == (1, 1, 1)
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+
+def test_concurrent_misses_share_one_computation():
+    async def scenario():
+        cache = ResponseCache(MemoryBackend())
+        compute = Counter()
+        results = await asyncio.gather(*(cache.get_or_compute("movie:1", compute) for _ in range(5)))
+        return results, compute.calls
+
+    results, calls = asyncio.run(scenario())
+    assert results == [1] * 5
+    assert calls == 1
+
+
+def test_stale_entry_is_served_and_refreshed_in_the_background():
+    async def scenario():
+        cache = ResponseCache(MemoryBackend(), ttl=60, stale_ttl=600)
+        compute = Counter()
+        await cache.get_or_compute("movie:1", compute)
+        _age(cache, "movie:1", 120)
+        stale = await cache.get_or_compute("movie:1", compute)
+        await asyncio.gather(*cache._in_flight.values())
+        refreshed = await cache.get_or_compute("movie:1", compute)
+        return stale, refreshed, compute.calls, cache.stats()
+
+    stale, refreshed, calls, stats = asyncio.run(scenario())
+    assert stale == 1
+    assert refreshed == 2
+    assert calls == 2
+    assert (stats["stale_hits"], stats["refreshes"], stats["hits"]) == (1, 1, 1)
+
+
+def test_incomplete_values_are_kept_briefly():
+    async def scenario():
+        cache = ResponseCache(MemoryBackend(), ttl=600, stale_ttl=0)
+        await cache.get_or_compute("movie:1", Counter([{"clip": None}]), is_complete=lambda value: None not in value.values())
+        return cache.backend._cache.get("movie:1")["ttl"]
+
+    assert asyncio.run(scenario()) == min(600, RESPONSE_CACHE_INCOMPLETE_TTL)
+
+
+def test_keys_follow_the_data_version():
+    cache = ResponseCache(MemoryBackend())
+    assert cache.set_data_versions({"ratings": 2, "movies": 1})
+    key = cache.key("movie", 1, "alpha=0.3")
+    assert key == "movie:1:alpha=0.3@movies=1,ratings=2"
+    assert not cache.set_data_versions({"movies": 1, "ratings": 2})
+    assert cache.key("movie", 1, "alpha=0.3") == key
+    assert cache.set_data_versions({"movies": 1, "ratings": 3})
+    assert cache.key("movie", 1, "alpha=0.3") != key
+
+
+def test_disabled_cache_always_computes():
+    async def scenario():
+        cache = ResponseCache(None)
+        compute = Counter()
+        await cache.get_or_compute("movie:1", compute)
+        await cache.get_or_compute("movie:1", compute)
+        return compute.calls
+
+    assert asyncio.run(scenario()) == 2
@@ -0,0 +1,114 @@
+import pytest
+
+from title_index import TitleIndex, normalize_title, split_query, title_variants, trigrams
+from tmdb import TMDB_IMAGE_BASE
+
+ROWS = [
+    (1, "American President, The (1995)", "/president.jpg"),
+    (2, "Heat (1995)", None),
+    (3, "Heat (1986)", None),
+    (4, "Seven (a.k.a. Se7en) (1995)", None),
+    (5, "Amélie (Fabuleux destin d'Amélie Poulain, Le) (2001)", None),
+    (6, "Blade Runner (1982)", None),
+    (7, "Blade Runner 2049 (2017)", None),
+    (8, "Heathers (1989)", None),
+    (9, "Star Wars: Episode IV - A New Hope (1977)", None),
+    (10, "Star Trek (2009)", None),
+    (11, "Starship Troopers (1997)", None),
+]
+
+
+@pytest.fixture
+def index():
+    index = TitleIndex()
+    index.build(ROWS, version="movies=1")
+    return index
+
+
+def test_normalize_title_moves_the_article_and_drops_the_year_accents_and_punctuation():
+    assert normalize_title("American President, The (1995)") == "the american president"
+    assert normalize_title("The American President") == "the american president"
+    assert normalize_title("Amélie") == "amelie"
+    assert normalize_title("Star Wars: Episode IV - A New Hope") == "star wars episode iv a new hope"
+
+
+def test_alternative_titles_are_separate_variants():
+    assert title_variants("Seven (a.k.a. Se7en) (1995)") == ["Seven", "Se7en"]
+
+
+def test_split_query_accepts_a_bare_year():
+    assert split_query("heat 1995") == ("heat", 1995)
+    assert split_query("Heat (1995)") == ("Heat", 1995)
+    assert split_query("1984") == ("1984", None)
+
+
+def test_trigrams_are_padded_like_pg_trgm():
+    assert trigrams("heat") == {"  h", " he", "hea", "eat", "at "}
+
+
+def test_match_uses_the_year_to_break_ties(index):
+    assert index.match("Heat (1986)") == (3, 1.0)
+    assert index.match("heat (1995)") == (2, 1.0)
+
+
+def test_match_finds_alternative_and_accented_titles(index):
+    assert index.match("Se7en")[0] == 4
+    assert index.match("amelie")[0] == 5
+    assert index.match("zzz") is None
+
+
+def test_resolve_keeps_the_position_of_the_matched_titles(index):
+    resolved = index.resolve(["The American President", "Qqqq xxxx", "Heat"])
+    assert [(position, movie_id) for position, movie_id, _ in resolved] == [(0, 1), (2, 2)]
+
+
+def test_unloaded_index_raises():
+    with pytest.raises(RuntimeError):
+        TitleIndex().match("Heat")
+
+
+def _ids(results):
+    return [result["id"] for result in results]
+
+
+def test_search_completes_the_last_word_as_a_prefix(index):
+    assert _ids(index.search("hea")) == [2, 3, 8]
+    assert _ids(index.search("star w")) == [9]
+
+
+def test_search_with_a_trailing_space_matches_whole_words(index):
+    assert _ids(index.search("heat ")) == [2, 3]
+
+
+def test_search_ranks_titles_starting_with_the_query_then_shorter_titles(index):
+    assert _ids(index.search("star")) == [10, 11, 9]
+    assert _ids(index.search("the american")) == [1]
+
+
+def test_search_filters_by_year(index):
+    assert _ids(index.search("heat 1986")) == [3]
+    assert _ids(index.search("heat (1986)")) == [3]
+    # No Heat from 1990, the year is ignored rather than returning nothing
+    assert _ids(index.search("heat 1990")) == [2, 3]
+
+
+def test_search_keeps_a_number_that_is_part_of_the_title(index):
+    assert _ids(index.search("blade runner 2049")) == [7]
+
+
+def test_search_falls_back_to_fuzzy_matching_on_typos(index):
+    assert _ids(index.search("blade runer")) == [6, 7]
+
+
+def test_search_returns_each_movie_once_with_its_display_fields(index):
+    assert _ids(index.search("se")) == [4]
+    assert index.search("american", limit=1) == [{
+        "id": 1,
+        "title": "American President, The",
+        "year": 1995,
+        "poster_url": f"{TMDB_IMAGE_BASE}/president.jpg",
+    }]
+
+
+def test_search_limit(index):
+    assert len(index.search("star", limit=2)) == 2
@@ -0,0 +1,43 @@
+import asyncio
+
+from tmdb import TMDBClient
+
+
+def _client(monkeypatch):
+    client = TMDBClient()
+
+    def fetch(tmdb_id):
+        client.requests += 1
+        return {"id": tmdb_id, "overview": "A heist.", "credits": {"cast": [{"name": "Al Pacino"}]}}
+
+    async def fetch_async(tmdb_id):
+        return fetch(tmdb_id)
+
+    monkeypatch.setattr(client, "_fetch", fetch)
+    monkeypatch.setattr(client, "_fetch_async", fetch_async)
+    return client
+
+
+def test_callers_cannot_change_the_cached_payload(monkeypatch):
+    client = _client(monkeypatch)
+    movie = client.get_movie(949)
+    movie["overview"] = None
+    movie["credits"]["cast"].clear()
+    cached = client.get_movie(949)
+    assert cached["overview"] == "A heist."
+    assert cached["credits"]["cast"] == [{"name": "Al Pacino"}]
+    assert client.requests == 1
+
+
+def test_async_callers_get_their_own_copies(monkeypatch):
+    client = _client(monkeypatch)
+
+    async def scenario():
+        first, second = await asyncio.gather(client.get_movie_async(949), client.get_movie_async(949))
+        first["credits"]["cast"].append({"name": "Robert De Niro"})
+        return first, second, await client.get_movie_async(949)
+
+    first, second, third = asyncio.run(scenario())
+    assert first is not second
+    assert second["credits"]["cast"] == third["credits"]["cast"] == [{"name": "Al Pacino"}]
+    assert (client.requests, client.coalesced) == (1, 1)
@@ -0,0 +1,305 @@
+import asyncio
+import bisect
+import re
+import unicodedata
+
+import numpy as np
+
+from tmdb import TMDB_IMAGE_BASE
+
+TITLE_INDEX_SQL = """
+    SELECT m.movieid, m.title, mm.poster_path
+    FROM movies m
+    LEFT JOIN movies_metadata mm ON mm.id = m.movieid;
+"""
+# data_versions the index is built from: the catalog titles and the harvested poster paths
+TITLE_INDEX_DATA_VERSIONS = ("movies", "metadata")
+# Fuzzy matches less similar than this aren't worth suggesting
+FUZZY_MIN_SIMILARITY = 0.3
+
+# MovieLens moves leading articles to the end: "American President, The (1995)"
+_TRAILING_ARTICLE = re.compile(r"^(.*), (the|a|an|les|la|le|l'|il|el|los|las|der|die|das|den|det)$", re.IGNORECASE)
+_YEAR = re.compile(r"\s*\((\d{4})\)\s*$")
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+# Alternative titles follow the main one in parentheses: "Seven (a.k.a. Se7en) (1995)"
+_ALTERNATIVE = re.compile(r"\s*\(([^()]*)\)")
+_QUERY_YEAR = re.compile(r"\s+((?:18|19|20)\d{2})\s*$")
+_AKA = re.compile(r"^a\.k\.a\.\s*", re.IGNORECASE)
+
+
+def split_title(title: str):
+    """
+    Returns (title without the trailing year, year or None).
+    """
+    match = _YEAR.search(title)
+    if match is None:
+        return title.strip(), None
+    return title[:match.start()].strip(), int(match.group(1))
+
+
+def normalize_title(title: str) -> str:
+    """
+    Lower-cased ASCII title with the article in front and the year and punctuation removed,
+    so "American President, The (1995)" and "The American President" normalise the same way.
+    """
+    title, _ = split_title(title)
+    match = _TRAILING_ARTICLE.match(title)
+    if match:
+        title = f"{match.group(2)} {match.group(1)}"
+    title = unicodedata.normalize("NFKD", title).encode("ascii", "ignore").decode("ascii").lower()
+    return _NON_ALNUM.sub(" ", title).strip()
+
+
+def split_query(query: str):
+    """
+    Like split_title, but a search query may also end with a bare year: "heat 1995".
+    """
+    title, year = split_title(query)
+    if year is None:
+        match = _QUERY_YEAR.search(title)
+        if match and match.start() > 0:
+            title, year = title[:match.start()].strip(), int(match.group(1))
+    return title, year
+
+
+def title_variants(title: str):
+    """
+    The main title and every parenthesised alternative title, each one searchable on its own.
+    """
+    title, _ = split_title(title)
+    variants = [_ALTERNATIVE.sub("", title).strip() or title]
+    variants.extend(_AKA.sub("", alternative).strip() for alternative in _ALTERNATIVE.findall(title))
+    return [variant for variant in variants if variant]
+
+
+def trigrams(text: str) -> set:
+    """
+    pg_trgm-style trigrams: every word padded with two spaces in front and one behind.
+    """
+    result = set()
+    for word in text.split():
+        padded = f"  {word} "
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+class _Snapshot:
+    """
+    One entry per title variant, so a movie can own several entries.
+    Entries are indexed twice: by trigram for fuzzy matching and by whole word for autocomplete.
+    """
+
+    def __init__(self, rows):
+        movie_ids, years, counts, lengths = [], [], [], []
+        postings, word_postings = {}, {}
+        self.normalized = []
+        self.movies = {}
+        for movie_id, title, *rest in rows:
+            display_title, year = split_title(title)
+            self.movies[movie_id] = (display_title, year, rest[0] if rest else None)
+            for variant in title_variants(title):
+                normalized = normalize_title(variant)
+                grams = trigrams(normalized)
+                position = len(movie_ids)
+                movie_ids.append(movie_id)
+                years.append(year or 0)
+                counts.append(len(grams))
+                lengths.append(len(normalized))
+                self.normalized.append(normalized)
+                for gram in grams:
+                    postings.setdefault(gram, []).append(position)
+                for word in set(normalized.split()):
+                    word_postings.setdefault(word, []).append(position)
+        self.movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        self.years = np.asarray(years, dtype=np.int32)
+        self.trigram_counts = np.asarray(counts, dtype=np.int32)
+        self.lengths = np.asarray(lengths, dtype=np.int32)
+        self.postings = {gram: np.asarray(positions, dtype=np.int32) for gram, positions in postings.items()}
+        # Posting lists are sorted by construction, which np.intersect1d relies on being cheap
+        self.word_postings = {word: np.asarray(positions, dtype=np.int32) for word, positions in word_postings.items()}
+        self.vocabulary = sorted(self.word_postings)
+        self.known_years = set(int(year) for year in np.unique(self.years))
+
+
+class TitleIndex:
+    """
+    In-memory index over the normalised movie titles and their alternative titles.
+
+    Each trigram has a posting list of title entries, a fuzzy lookup counts the trigrams a query
+    shares with every entry and scores them with the same similarity as pg_trgm
+    (shared / (query + title - shared)). Each word has a posting list too: autocomplete intersects
+    the lists of the typed words with the union of the lists of the words starting with the last,
+    unfinished one. Rebuilt from the movies table, readers keep using the previous snapshot
+    until the new one is swapped in.
+    """
+
+    def __init__(self):
+        self._snapshot = None
+        self.version = None
+
+    @property
+    def ready(self) -> bool:
+        return self._snapshot is not None
+
+    def build(self, rows, version=None):
+        """
+        Builds the index from (movie_id, title) or (movie_id, title, poster_path) rows.
+        """
+        self._snapshot = _Snapshot(list(rows))
+        self.version = version
+
+    def load(self, conn, version=None):
+        with conn.cursor() as cur:
+            cur.execute(TITLE_INDEX_SQL)
+            rows = cur.fetchall()
+        self.build(rows, version)
+
+    async def load_async(self, conn, version=None):
+        async with conn.cursor() as cur:
+            await cur.execute(TITLE_INDEX_SQL)
+            rows = await cur.fetchall()
+        # Building takes a fraction of a second, keep the event loop serving meanwhile
+        await asyncio.to_thread(self.build, rows, version)
+
+    def _similarities(self, snapshot, query: str):
+        grams = trigrams(normalize_title(query))
+        if not grams:
+            return None
+        positions = [snapshot.postings[gram] for gram in grams if gram in snapshot.postings]
+        if not positions:
+            return None
+        shared = np.bincount(np.concatenate(positions), minlength=len(snapshot.movie_ids))
+        return shared / (len(grams) + snapshot.trigram_counts - shared)
+
+    def match(self, title: str):
+        """
+        Returns (movie_id, similarity) of the best matching title, or None when no title shares a trigram.
+        A year in the query ("Heat (1995)") decides between equally similar titles.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            raise RuntimeError("The title index isn't loaded")
+        similarities = self._similarities(snapshot, title)
+        if similarities is None:
+            return None
+        _, year = split_title(title)
+        ranking = similarities + (snapshot.years == year) * 1e-3 if year else similarities
+        best = int(np.argmax(ranking))
+        if similarities[best] <= 0:
+            return None
+        return int(snapshot.movie_ids[best]), float(similarities[best])
+
+    def resolve(self, titles, threshold=0.6):
+        """
+        Same contract as db.resolve_movie_titles: (position, movie id, similarity) of every title
+        whose best match is closer than the trigram distance `threshold`.
+        """
+        resolved = []
+        for position, title in enumerate(titles):
+            match = self.match(title)
+            if match is not None and 1.0 - match[1] < threshold:
+                resolved.append((position, match[0], match[1]))
+        return resolved
+
+    def search(self, query: str, limit: int = 10, min_similarity: float = FUZZY_MIN_SIMILARITY):
+        """
+        Autocomplete lookup. Returns up to `limit` lightweight results
+        {"id", "title", "year", "poster_url"}, best first.
+
+        Titles containing every typed word (the last one as a prefix) rank first, titles starting
+        with the query before the others and shorter titles before longer ones. When no title
+        contains the words, e.g. because of a typo, the fuzzy trigram similarity ranks them.
+        A year ("heat 1995" or "heat (1995)") restricts the results to that year when any match it.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            raise RuntimeError("The title index isn't loaded")
+        title, year = split_query(query)
+        if year is not None and year not in snapshot.known_years:
+            # A number in the title, like "Blade Runner 2049"
+            title, year = query, None
+        normalized = normalize_title(title)
+        if not normalized:
+            return []
+
+        entries = self._word_matches(snapshot, normalized, prefix=not query.endswith(" "))
+        if entries is not None and len(entries):
+            entries = self._filter_year(snapshot, entries, year)
+            # Only the shortest candidates can make it to the top, rank those
+            if len(entries) > limit * 20:
+                entries = entries[np.argpartition(snapshot.lengths[entries], limit * 20)[:limit * 20]]
+            ranked = sorted(
+                entries.tolist(),
+                key=lambda entry: (not snapshot.normalized[entry].startswith(normalized), snapshot.lengths[entry]),
+            )
+        else:
+            similarities = self._similarities(snapshot, title)
+            if similarities is None:
+                return []
+            entries = np.flatnonzero(similarities >= min_similarity)
+            entries = self._filter_year(snapshot, entries, year)
+            ranked = entries[np.argsort(-similarities[entries], kind="stable")].tolist()
+
+        results = []
+        seen = set()
+        for entry in ranked:
+            movie_id = int(snapshot.movie_ids[entry])
+            if movie_id in seen:
+                continue
+            seen.add(movie_id)
+            display_title, movie_year, poster_path = snapshot.movies[movie_id]
+            results.append({
+                "id": movie_id,
+                "title": display_title,
+                "year": movie_year,
+                "poster_url": f"{TMDB_IMAGE_BASE}{poster_path}" if poster_path else None,
+            })
+            if len(results) >= limit:
+                break
+        return results
+
+    @staticmethod
+    def _word_matches(snapshot, normalized, prefix):
+        """
+        Entries containing every word of the query, the last one only as a prefix when `prefix`.
+        Returns None when a word is unknown.
+        """
+        words = normalized.split()
+        complete, last = (words[:-1], words[-1]) if prefix else (words, None)
+        entries = None
+        for word in complete:
+            postings = snapshot.word_postings.get(word)
+            if postings is None:
+                return None
+            entries = postings if entries is None else np.intersect1d(entries, postings, assume_unique=True)
+        if last is not None:
+            start = bisect.bisect_left(snapshot.vocabulary, last)
+            stop = bisect.bisect_left(snapshot.vocabulary, last + "\x7f", lo=start)
+            if start == stop:
+                return None
+            postings = [snapshot.word_postings[word] for word in snapshot.vocabulary[start:stop]]
+            postings = postings[0] if len(postings) == 1 else np.unique(np.concatenate(postings))
+            entries = postings if entries is None else np.intersect1d(entries, postings, assume_unique=True)
+        return entries
+
+    @staticmethod
+    def _filter_year(snapshot, entries, year):
+        if not year:
+            return entries
+        same_year = entries[snapshot.years[entries] == year]
+        return same_year if len(same_year) else entries
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        if snapshot is None:
+            return {"ready": False}
+        return {
+            "ready": True,
+            "version": self.version,
+            "titles": len(snapshot.movies),
+            "entries": len(snapshot.movie_ids),
+            "trigrams": len(snapshot.postings),
+        }
+
+
+title_index = TitleIndex()
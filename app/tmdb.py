@@ -1,105 +1,265 @@
+import asyncio
 import requests
+import httpx
 import os
+import threading
+from concurrent.futures import Future
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from cache import MISSING, TTLCache
+from metrics import timed
 
 
 API_TOKEN = os.environ.get("TMDB_API_TOKEN", "a3c51992e634917c008b8f2eea669b3d")
-TMDB_IMAGE_BASE = "https://image.tmdb.org/t/p/w500"
+# Both can point to a local stand-in, see benchmarks/fake_services.py
+TMDB_IMAGE_BASE = os.getenv("TMDB_IMAGE_BASE", "https://image.tmdb.org/t/p/w500")
 API_VERSION = '3'
-BASE_URL = 'https://api.themoviedb.org'
+BASE_URL = os.getenv("TMDB_BASE_URL", 'https://api.themoviedb.org')
 
+# Movie payloads rarely change, keep them for a day
+TMDB_CACHE_SIZE = int(os.getenv("TMDB_CACHE_SIZE", "20000"))
+TMDB_CACHE_TTL = float(os.getenv("TMDB_CACHE_TTL", "86400"))
+# Only the top of the cast is ever shown, the rest of the credits isn't cached
+CAST_SIZE = 5
 
-def get_poster_path(tmdbid: int) -> str:
-    poster_url = None
-    tmdb_resp = requests.get(
-        f"https://api.themoviedb.org/3/movie/{tmdbid}",
-        params={"api_key": API_TOKEN, "language": "en-US"},
-        timeout=5
-    )
-    if tmdb_resp.ok:
-        data = tmdb_resp.json()
-        path = data.get("poster_path")
-        if path:
-            poster_url = f"{TMDB_IMAGE_BASE}{path}"
-    return poster_url
+# Shared keep-alive session for the sync helpers, safe to use from the harvester's worker threads
+_session = None
+_session_lock = threading.Lock()
 
+# Shared keep-alive client for the async helpers, created lazily inside the running event loop
+_async_client = None
 
-def get_overview(tmdbid: int) -> str:
-    poster_url = None
-    tmdb_resp = requests.get(
-        f"https://api.themoviedb.org/3/movie/{tmdbid}",
-        params={"api_key": API_TOKEN, "language": "en-US"},
-        timeout=5
-    )
-    if tmdb_resp.ok:
-        data = tmdb_resp.json()
-        path = data.get("overview")
-        if path:
-            poster_url = f"{TMDB_IMAGE_BASE}{path}"
-    return poster_url
 
+def get_session(pool_size: int = 32) -> requests.Session:
+    """
+    Returns the process-wide TMDB session. Throttling (429) and transient 5xx answers
+    are retried with backoff, honouring Retry-After.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=5,
+                backoff_factor=0.5,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=("GET",),
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            )
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
 
-def get_movie_data(tmdb_id: int) -> dict:
-    base_url = "https://api.themoviedb.org/3/movie"
-    url = f"{base_url}/{tmdb_id}"
-    params = {
-        "api_key": API_TOKEN,
-        "language": "en-US"
-    }
-    resp = requests.get(url, params=params, timeout=10)
-    resp.raise_for_status()
-    data = resp.json()
-    return data
-
-def get_movie_full_metadata(tmdb_id: int) -> dict:  
-    meta = {}
-    try:
-        # Retrieve main movie details
-        params = {
+
+def get_async_client() -> httpx.AsyncClient:
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(
+            base_url=BASE_URL,
+            timeout=httpx.Timeout(10, connect=5),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        )
+    return _async_client
+
+
+async def close_async_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+def _copy(movie_data: dict) -> dict:
+    # Callers get their own dicts, so changing one can't change the cached payload
+    return dict(movie_data, credits={"cast": list(movie_data["credits"]["cast"])})
+
+
+class TMDBClient:
+    """
+    One cached `/movie/{id}?append_to_response=credits` payload per movie, shared by every helper.
+    Every caller gets a copy of it.
+
+    Payloads are kept in a TTL cache keyed by tmdbid, and concurrent callers asking for the same
+    movie wait for the single request already in flight instead of sending their own.
+    The sync methods use the pooled requests session, the async ones the pooled httpx client.
+    Errors: network problems raise ConnectionError, unexpected answers raise RuntimeError.
+    """
+
+    def __init__(self, cache_size: int = TMDB_CACHE_SIZE, cache_ttl: float = TMDB_CACHE_TTL):
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._in_flight_async = {}
+        self.requests = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def _params():
+        return {
             "api_key": API_TOKEN,
-            "language": "en-US"
+            "language": "en-US",
+            "append_to_response": "credits",
         }
 
-        url = f"{BASE_URL}/{API_VERSION}/movie/{tmdb_id}"
-        response = requests.get(url, params=params)
+    @staticmethod
+    def _payload(tmdb_id, status_code, text, data_loader):
+        if status_code != 200:
+            raise RuntimeError(f"Data error: Failed to fetch movie details for ID {tmdb_id}: {status_code} - {text}")
+        movie_data = data_loader()
+        credits = movie_data.get('credits') or {}
+        movie_data['credits'] = {'cast': credits.get('cast', [])[:CAST_SIZE]}
+        return movie_data
+
+    @timed("tmdb", "movie")
+    def _fetch(self, tmdb_id: int) -> dict:
+        with self._lock:
+            self.requests += 1
+        try:
+            response = get_session().get(f"{BASE_URL}/{API_VERSION}/movie/{tmdb_id}", params=self._params(), timeout=10)
+        except requests.exceptions.RequestException as e:
+            raise ConnectionError(f"Network-related error occurred while fetching movie metadata: {e}")
+        try:
+            return self._payload(tmdb_id, response.status_code, response.text, response.json)
+        except ValueError as e:
+            raise RuntimeError(f"Data error: {e}")
+
+    @timed("tmdb", "movie")
+    async def _fetch_async(self, tmdb_id: int) -> dict:
+        with self._lock:
+            self.requests += 1
+        try:
+            response = await get_async_client().get(f"/{API_VERSION}/movie/{tmdb_id}", params=self._params())
+        except httpx.HTTPError as e:
+            raise ConnectionError(f"Network-related error occurred while fetching movie metadata: {e}")
+        try:
+            return self._payload(tmdb_id, response.status_code, response.text, response.json)
+        except ValueError as e:
+            raise RuntimeError(f"Data error: {e}")
+
+    def get_movie(self, tmdb_id: int) -> dict:
+        """
+        Returns the movie payload with its top cast under 'credits'.
+        """
+        movie_data = self._cache.get(tmdb_id)
+        if movie_data is not MISSING:
+            return _copy(movie_data)
+
+        with self._lock:
+            future = self._in_flight.get(tmdb_id)
+            owner = future is None
+            if owner:
+                future = self._in_flight[tmdb_id] = Future()
+            else:
+                self.coalesced += 1
+
+        if owner:
+            try:
+                movie_data = self._fetch(tmdb_id)
+                self._cache.set(tmdb_id, movie_data)
+                future.set_result(movie_data)
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._in_flight.pop(tmdb_id, None)
+        return _copy(future.result())
 
-        if response.status_code != 200:
-            raise ValueError(f"Failed to fetch movie details for ID {tmdb_id}: {response.status_code} - {response.text}")
+    async def get_movie_async(self, tmdb_id: int) -> dict:
+        movie_data = self._cache.get(tmdb_id)
+        if movie_data is not MISSING:
+            return _copy(movie_data)
 
-        movie_data = response.json()
-        meta['title'] = movie_data.get('original_title', 'Unknown Title')
-        meta['sinopsis'] = movie_data.get('overview', 'No synopsis available.')
-        # Retrieving name of the genre (we don't need its ID)
-        meta['genres'] = [g.get('name') for g in movie_data.get('genres', [])]
-        meta['poster_path'] = movie_data.get('poster_path')
-        meta['avg_rating'] = movie_data.get('vote_average')
+        task = self._in_flight_async.get(tmdb_id)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_and_cache_async(tmdb_id))
+            self._in_flight_async[tmdb_id] = task
+            task.add_done_callback(lambda _: self._in_flight_async.pop(tmdb_id, None))
+        else:
+            with self._lock:
+                self.coalesced += 1
+        # A cancelled caller mustn't cancel the request the other callers are waiting for
+        return _copy(await asyncio.shield(task))
 
-        # Retrieve cast info
-        url = f"{BASE_URL}/{API_VERSION}/movie/{tmdb_id}/credits"
-        response = requests.get(url, params=params)
+    async def _fetch_and_cache_async(self, tmdb_id: int) -> dict:
+        movie_data = await self._fetch_async(tmdb_id)
+        self._cache.set(tmdb_id, movie_data)
+        return movie_data
 
-        if response.status_code != 200:
-            raise ValueError(f"Failed to fetch credits for movie ID {tmdb_id}: {response.status_code} - {response.text}")
+    def invalidate(self, tmdb_id: int = None):
+        if tmdb_id is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(tmdb_id)
 
-        credits_data = response.json()
-        top_cast = credits_data.get('cast', [])[:5]
-        
-        # Retrieving name of the actor (we don't need their ID)
-        meta['cast'] = [actor.get('name', 'Unknown') for actor in top_cast]
+    def stats(self) -> dict:
+        return dict(self._cache.stats(), requests=self.requests, coalesced=self.coalesced)
 
-        # Add a link to the tmdb page
-        meta['tmdb_url'] = f"https://www.themoviedb.org/movie/{tmdb_id}"
 
-    except requests.exceptions.RequestException as e:
-        raise ConnectionError(f"Network-related error occurred while fetching movie metadata: {e}")
+tmdb_client = TMDBClient()
 
-    except ValueError as e:
-        raise RuntimeError(f"Data error: {e}")
 
-    except Exception as e:
-        raise RuntimeError(f"Unexpected error while fetching metadata for movie ID {tmdb_id}: {e}")
+def _poster_url(movie_data: dict) -> str:
+    path = movie_data.get("poster_path")
+    return f"{TMDB_IMAGE_BASE}{path}" if path else None
+
+
+def get_poster_path(tmdbid: int) -> str:
+    try:
+        return _poster_url(tmdb_client.get_movie(tmdbid))
+    except (RuntimeError, ConnectionError):
+        return None
+
+
+async def get_poster_path_async(tmdbid: int) -> str:
+    try:
+        return _poster_url(await tmdb_client.get_movie_async(tmdbid))
+    except (RuntimeError, ConnectionError):
+        return None
+
+
+def get_overview(tmdbid: int) -> str:
+    try:
+        return tmdb_client.get_movie(tmdbid).get("overview") or None
+    except (RuntimeError, ConnectionError):
+        return None
+
+
+def get_movie_data(tmdb_id: int) -> dict:
+    return tmdb_client.get_movie(tmdb_id)
+
+
+def get_movie_full_metadata(tmdb_id: int) -> dict:
+    movie_data = tmdb_client.get_movie(tmdb_id)
+    return _parse_movie_metadata(tmdb_id, movie_data, movie_data['credits'])
+
+
+async def get_movie_full_metadata_async(tmdb_id: int) -> dict:
+    movie_data = await tmdb_client.get_movie_async(tmdb_id)
+    return _parse_movie_metadata(tmdb_id, movie_data, movie_data['credits'])
+
+
+def _parse_movie_metadata(tmdb_id: int, movie_data: dict, credits_data: dict) -> dict:
+    meta = {}
+    meta['title'] = movie_data.get('original_title', 'Unknown Title')
+    meta['sinopsis'] = movie_data.get('overview', 'No synopsis available.')
+    # Retrieving name of the genre (we don't need its ID)
+    meta['genres'] = [g.get('name') for g in movie_data.get('genres', [])]
+    meta['poster_path'] = movie_data.get('poster_path')
+    meta['avg_rating'] = movie_data.get('vote_average')
+
+    top_cast = credits_data.get('cast', [])[:5]
+    # Retrieving name of the actor (we don't need their ID)
+    meta['cast'] = [actor.get('name', 'Unknown') for actor in top_cast]
 
+    # Add a link to the tmdb page
+    meta['tmdb_url'] = f"https://www.themoviedb.org/movie/{tmdb_id}"
     return meta
 
 if __name__ == "__main__":
     data = get_movie_full_metadata(550)
-    print(data)
\ No newline at end of file
+    print(data)
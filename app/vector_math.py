@@ -0,0 +1,21 @@
+import numpy as np
+
+# NumPy helpers shared by the in-memory index and the offline processors.
+# Kept apart from memory_index so the processors don't import psycopg2/pgvector and the index just to normalise rows.
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k_smallest(distances, k):
+    """
+    Returns (indices, values) of the k smallest entries of every row, sorted ascending.
+    """
+    k = min(k, distances.shape[1])
+    part = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    part_values = np.take_along_axis(distances, part, axis=1)
+    order = np.argsort(part_values, axis=1)
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(part_values, order, axis=1)